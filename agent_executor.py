@@ -1,25 +1,56 @@
 import os
 import json
-from openai import OpenAI
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from llm_client import astream, chat
 from dotenv import load_dotenv
 
 from tools import (
     FUNCTION_MAP as function_map,
     FUNCTION_SCHEMAS as functions,
+    extract_image_arrays,
     extract_image_paths
 )
+from session_store import sessions
 from agent_parser import (
+    aparse_user_intent,
     parse_user_intent,
     resolve_image_path
 )
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-# ========== Memory for Last Analysis ==========
-last_result_text = None
-last_result_dict = None
-last_image_path = None
+# ========== Memory for Last Analysis (per session) ==========
+def answer_follow_up(query: str, result: dict):
+    """Answer metric follow-ups from the structured result of the last analyzed image; None if not one."""
+    def fmt(key):
+        value = result.get(key)
+        return "N/A" if value is None else round(float(value), 2)
+
+    if "max width" in query:
+        return f"Max Width: {fmt('Max Width (mm)')} mm"
+    if "avg width" in query or "average width" in query:
+        return f"Avg Width: {fmt('Avg Width (mm)')} mm"
+    if "area" in query:
+        return f"Area: {fmt('Area (mm^2)')} mm²"
+    if "length" in query:
+        return f"Length: {fmt('Length (mm)')} mm"
+    if "compliant" in query or "compliance" in query:
+        status = {k: bool(v) for k, v in result.items() if k.endswith("OK")}
+        return f"Compliance: {status}"
+    return None
+
+
+def _advice_prompt(result: dict) -> str:
+    return ("You are a crack repair expert. Based on the following result, give suggestions:\n\n"
+            f"{json.dumps(result, indent=2, default=lambda v: v.item() if hasattr(v, 'item') else str(v))}")
+
+
+def _remember(session_id, tool, params, result):
+    if tool == "analyze_one_image" and getattr(result, "data", None) is not None:
+        sessions.update(session_id, result=result.data, result_text=str(result),
+                        image_path=params.get("image_path"))
 
 # ========== Utility: fallback path correction ==========
 def try_correct_image_filename(wrong_path: str) -> str:
@@ -34,8 +65,7 @@ def try_correct_image_filename(wrong_path: str) -> str:
     return None
 
 # ========== CLI Entry ==========
-def run_agent():
-    global last_result_text, last_result_dict, last_image_path
+def run_agent(session_id: str = "cli"):
     print("🤖 Crack Analysis Agent is ready. Enter your instruction ('exit' to quit):")
     history = []
 
@@ -50,45 +80,24 @@ def run_agent():
         params = parsed.get("parameters", {})
 
         if not tool or tool not in function_map:
-            query = user_input.lower()
-            if last_result_dict:
-                if "max width" in query:
-                    print(f"\n🤖 Max Width: {last_result_dict.get('Max Width (mm)', 'N/A')} mm")
-                    continue
-                if "avg width" in query or "average width" in query:
-                    print(f"\n🤖 Avg Width: {last_result_dict.get('Avg Width (mm)', 'N/A')} mm")
-                    continue
-                if "area" in query:
-                    print(f"\n🤖 Area: {last_result_dict.get('Area (mm^2)', 'N/A')} mm²")
-                    continue
-                if "length" in query:
-                    print(f"\n🤖 Length: {last_result_dict.get('Length (mm)', 'N/A')} mm")
-                    continue
-                if "compliant" in query:
-                    flags = [k for k in last_result_dict if k.endswith("OK")]
-                    status = {k: last_result_dict[k] for k in flags}
-                    print(f"\n🤖 Compliance: {status}")
+            # The local router passes a normalized query ("how long" -> "length")
+            query = (params.get("query") if isinstance(params, dict) else None) or user_input.lower()
+            last_result = sessions.get(session_id).result
+            if last_result:
+                answer = answer_follow_up(query, last_result)
+                if answer:
+                    print(f"\n🤖 {answer}")
                     continue
                 if any(k in query for k in ["advice", "repair", "fix", "how should", "what should"]):
-                    summary_prompt = f"You are a crack repair expert. Based on the following result, give suggestions:\n\n{json.dumps(last_result_dict, indent=2)}"
-                    completion = client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[{"role": "user", "content": summary_prompt}],
-                        temperature=0.5
-                    )
-                    print(f"\n🤖 {completion.choices[0].message.content.strip()}")
+                    completion = chat([{"role": "user", "content": _advice_prompt(last_result)}], temperature=0.5)
+                    print(f"\n🤖 {completion.strip()}")
                     continue
             # fallback to GPT
             try:
-                completion = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "You are an intelligent assistant for a crack analysis system."},
-                        {"role": "user", "content": user_input}
-                    ],
-                    temperature=0.3
-                )
-                reply = completion.choices[0].message.content.strip()
+                reply = chat([
+                    {"role": "system", "content": "You are an intelligent assistant for a crack analysis system."},
+                    {"role": "user", "content": user_input}
+                ], temperature=0.3).strip()
                 print(f"\n🤖 {reply}")
                 history.append({"role": "user", "content": user_input})
                 history.append({"role": "assistant", "content": reply})
@@ -118,60 +127,32 @@ def run_agent():
         history.append({"role": "user", "content": user_input})
         history.append({"role": "assistant", "content": result})
 
-        if tool == "analyze_one_image" and isinstance(result, str):
-            last_result_text = result
-            last_image_path = params.get("image_path")
-            try:
-                last_result_dict = {
-                    line.split(":")[0].strip(): line.split(":")[1].strip()
-                    for line in result.splitlines()[2:] if ":" in line
-                }
-            except:
-                last_result_dict = None
+        _remember(session_id, tool, params, result)
 
-# ========== For UI (Gradio etc.) ==========
-def agent_respond(user_input: str):
-    global last_result_text, last_result_dict, last_image_path
-    parsed = parse_user_intent(user_input)
-    tool = parsed.get("tool")
-    params = parsed.get("parameters", {})
+# ========== Async Agent Core (UI, concurrent requests) ==========
+# CPU-bound tools (UNet + quantification) run in a thread pool so the event loop keeps serving
+# other requests; full-folder batch runs share output files and are serialized.
+TOOL_WORKERS = int(os.getenv("CRACK_TOOL_WORKERS", "4"))
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="agent-tool")
+_batch_lock = threading.Lock()
+SERIALIZED_TOOLS = {"analyze_all_images"}
 
-    if not tool or tool not in function_map:
-        query = user_input.lower()
-        if last_result_dict:
-            if "max width" in query:
-                return f"Max Width: {last_result_dict.get('Max Width (mm)', 'N/A')} mm", {}
-            if "area" in query:
-                return f"Area: {last_result_dict.get('Area (mm^2)', 'N/A')} mm²", {}
-            if "length" in query:
-                return f"Length: {last_result_dict.get('Length (mm)', 'N/A')} mm", {}
-            if any(k in query for k in ["advice", "repair", "fix", "how should", "what should"]):
-                summary_prompt = f"You are a crack repair expert. Based on the following result, give suggestions:\n\n{json.dumps(last_result_dict, indent=2)}"
-                completion = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": summary_prompt}],
-                    temperature=0.5
-                )
-                return completion.choices[0].message.content.strip(), {}
 
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an intelligent assistant for a crack analysis system."},
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=0.3
-            )
-            return completion.choices[0].message.content.strip(), {}
-        except Exception as e:
-            return f"❌ GPT fallback failed: {type(e).__name__}: {e}", {}
+def _run_tool(tool: str, params: dict):
+    fn = function_map[tool]
+    if tool in SERIALIZED_TOOLS:
+        with _batch_lock:
+            return fn(params)
+    return fn(params)
+
 
+def _prepare_params(params: dict):
+    """Resolve image_path / image_index into an existing file; returns an error string on failure."""
     try:
         if "image_index" in params or "image_path" in params:
             params["image_path"] = resolve_image_path(params)
     except Exception as e:
-        return f"❌ Failed to resolve image: {e}", {}
+        return f"❌ Failed to resolve image: {e}"
 
     if "image_path" in params and not os.path.exists(params["image_path"]):
         corrected = try_correct_image_filename(params["image_path"])
@@ -179,23 +160,97 @@ def agent_respond(user_input: str):
             params["image_path"] = corrected
 
     params.pop("image_index", None)
-    fn = function_map[tool]
-    result = fn(params)
+    return None
+
+
+async def agent_respond_stream(user_input: str, with_arrays: bool = False, session_id: str = "default"):
+    """
+    Async agent turn that yields (reply_so_far, paths) as the reply grows:
+    LLM replies are streamed chunk by chunk, tool calls yield a status line first and
+    then the tool result once the worker thread finishes. Many turns can be in flight at once.
+    with_arrays=True yields the tool result's in-memory image arrays (extract_image_arrays) instead of file paths.
+    Follow-up questions are answered from the session's structured result (see session_store).
+    """
+    parsed = await aparse_user_intent(user_input)
+    tool = parsed.get("tool")
+    params = parsed.get("parameters", {})
+
+    if not tool or tool not in function_map:
+        # The local router passes a normalized query ("how long" -> "length")
+        query = (params.get("query") if isinstance(params, dict) else None) or user_input.lower()
+        messages = [
+            {"role": "system", "content": "You are an intelligent assistant for a crack analysis system."},
+            {"role": "user", "content": user_input}
+        ]
+        temperature = 0.3
+        last_result = sessions.get(session_id).result
+        if last_result:
+            answer = answer_follow_up(query, last_result)
+            if answer:
+                yield answer, {}
+                return
+            if any(k in query for k in ["advice", "repair", "fix", "how should", "what should"]):
+                messages = [{"role": "user", "content": _advice_prompt(last_result)}]
+                temperature = 0.5
 
-    if tool == "analyze_one_image" and isinstance(result, str):
-        last_result_text = result
-        last_image_path = params.get("image_path")
+        reply = ""
         try:
-            last_result_dict = {
-                line.split(":")[0].strip(): line.split(":")[1].strip()
-                for line in result.splitlines()[2:] if ":" in line
-            }
-        except:
-            last_result_dict = None
-
-    image_reference = params.get("image_path", user_input)
-    paths = extract_image_paths(image_reference)
-    return result, paths
+            async for delta in astream(messages, temperature=temperature):
+                reply += delta
+                yield reply, {}
+        except Exception as e:
+            yield f"❌ GPT fallback failed: {type(e).__name__}: {e}", {}
+            return
+        if not reply:
+            yield reply, {}
+        return
+
+    error = _prepare_params(params)
+    if error:
+        yield error, {}
+        return
+
+    yield f"🔧 Running tool: {tool}({params})", {}
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(_tool_executor, _run_tool, tool, params)
+
+    _remember(session_id, tool, params, result)
+
+    if with_arrays:
+        paths = extract_image_arrays(result)
+    else:
+        image_reference = params.get("image_path", user_input)
+        paths = await loop.run_in_executor(_tool_executor, extract_image_paths, image_reference)
+    yield result, paths
+
+
+async def agent_respond_async(user_input: str, session_id: str = "default"):
+    """Async agent turn returning the final (result, paths)."""
+    reply, paths = "", {}
+    async for reply, paths in agent_respond_stream(user_input, session_id=session_id):
+        pass
+    return reply, paths
+
+
+# ========== For UI (Gradio etc.) ==========
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    """One long-lived event loop for blocking callers, so async clients and their connections are reused."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="agent-loop", daemon=True).start()
+    return _loop
+
+
+def agent_respond(user_input: str, session_id: str = "default"):
+    """Blocking wrapper around the async core; safe to call from several threads at once."""
+    return asyncio.run_coroutine_threadsafe(agent_respond_async(user_input, session_id=session_id),
+                                            _background_loop()).result()
 
 # ========== Optional Fallback ==========
 def handle_user_request(user_input: str) -> str:
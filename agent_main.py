@@ -4,70 +4,211 @@ import os
 import cv2
 import numpy as np
 import pandas as pd
-from crack_predict_code.predict import run_prediction
-from crack_quantification.quantifier import compute_features
+from crack_predict_code.predict import run_probability, run_probability_tiled, threshold_mask, weights_hash
+from crack_quantification.quantifier import quantify_mask
+from result_cache import result_cache
+from pipeline import (run_pipeline, make_cache_key, load_cached, save_result_images, save_probability_map,
+                      load_probability_map, probability_map_path, reconcile_probability_map)
+from mask_store import mask_store
+from results_store import results_store
+from manifest import load_manifest, update_manifest, make_entry, is_up_to_date
+from instrumentation import metrics, stage, timed, profiled, log_event, write_metrics_file
 
 
-def process_image(image_path, pixel_size_mm=0.1):
-    image = cv2.imread(image_path)
+@profiled("process_image")
+@timed("process_image")
+def process_image(image_path, pixel_size_mm=0.1, tiled=False, tile_size=896, stride=768, per_crack=False,
+                  use_cache=True, model_name="default", threshold=0.5, save_probability=False,
+                  prob_dtype="uint8", return_images=False):
+    """
+    单张图像：读取 → 推理 → 量化 → 保存，返回结构化结果。
+    return_images=True 时返回 (result, images)，images 为本次结果对应的内存数组
+    {"original": BGR 原图, "mask": uint8 掩膜, "width": 宽度可视化图}，界面无需再读盘解码。
+    """
+    with stage("read"), open(image_path, "rb") as f:
+        data = f.read()
+
+    # 已保存的概率图若对应旧的图像内容、模型或切片参数，先删除
+    prob_meta = reconcile_probability_map(image_path, data, model_name, tiled, tile_size, stride)
+
+    # 0. 结果缓存：同一图像内容 + 模型权重 + 参数只推理一次
+    cache_key = None
+    if use_cache:
+        cache_key = make_cache_key(data, pixel_size_mm, tiled, tile_size, stride, per_crack, model_name,
+                                   threshold)
+        # 缓存中不含概率图，需要保存而磁盘上没有时重新推理
+        if not (save_probability and probability_map_path(image_path) is None):
+            cached = load_cached(image_path, cache_key, with_arrays=return_images)
+            if cached is not None:
+                metrics.inc("cache_hits")
+                if not return_images:
+                    return cached
+                result, mask_uint8, width_vis = cached
+                with stage("decode"):
+                    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                return result, {"original": image, "mask": mask_uint8, "width": width_vis}
+
+    with stage("decode"):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
     if image is None:
         raise FileNotFoundError(f"无法读取图像：{image_path}")
 
-    # 1. 模型预测
-    mask = run_prediction(image)  # float32, 0./1.
+    # 1. 模型预测（tiled=True 时按原始分辨率切片推理，概率图与原图像素一一对应）
+    if tiled:
+        prob = run_probability_tiled(image, tile_size=tile_size, stride=stride, model_name=model_name)
+    else:
+        prob = run_probability(image, model_name=model_name)  # float32, [0, 1]
+    if save_probability:
+        save_probability_map(image_path, prob, prob_dtype, prob_meta)
+    with stage("threshold"):
+        mask = threshold_mask(prob, threshold)  # float32, 0./1.
+
+    metrics.inc("images_processed")
+    result, mask_uint8, width_vis = quantify_and_save(image_path, mask, pixel_size_mm=pixel_size_mm,
+                                                      per_crack=per_crack, cache_key=cache_key,
+                                                      with_arrays=True)
+    if not return_images:
+        return result
+    return result, {"original": image, "mask": mask_uint8, "width": width_vis}
+
+
+def quantify_and_save(image_path, mask, pixel_size_mm=0.1, per_crack=False, cache_key=None, with_arrays=False):
+    """
+    对已预测的掩膜做量化、保存结果图像，并返回结构化数据。
+    per_crack=True 时在 "Cracks" 字段附带逐条裂缝（连通域）的量化表。
+    给出 cache_key 时同时写入结果缓存。
+    with_arrays=True 时返回 (result, mask_uint8, width_vis)。
+    """
     mask_uint8 = (mask * 255).astype(np.uint8)
 
     # 2. 特征提取应使用 uint8 掩膜
-    features = compute_features(mask_uint8, pixel_size_mm=pixel_size_mm)
+    row, width_vis = quantify_mask(mask_uint8, pixel_size_mm, per_crack=per_crack)
 
     # 3. 保存图像
-    base_name = os.path.splitext(os.path.basename(image_path))[0]
-    output_dir = "output/result_images"
-    os.makedirs(output_dir, exist_ok=True)
-    cv2.imwrite(os.path.join(output_dir, f"{base_name}_mask.png"), mask_uint8)
-
-    width_vis = features.get("width_visualization")
-    if width_vis is not None:
-        if width_vis.dtype != np.uint8:
-            width_vis = (width_vis * 255).astype(np.uint8)
-        cv2.imwrite(os.path.join(output_dir, f"{base_name}_width.png"), width_vis)
+    save_result_images(image_path, mask_uint8, width_vis, source=cache_key)
 
     # 4. 返回结构化数据
-    result = {
-        "Filename": os.path.basename(image_path),
-        "Max Width (mm)": features["Max Width (mm)"],
-        "Avg Width (mm)": features["Avg Width (mm)"],
-        "Length (mm)": features["Length (mm)"],
-        "Area (mm^2)": features["Area (mm^2)"],
-        "Area Ratio": features["Area Ratio (%)"],
-        "Max Width OK": features["Compliance"]["Max Width OK"],
-        "Avg Width OK": features["Compliance"]["Avg Width OK"],
-        "Area Ratio OK": features["Compliance"]["Area Ratio OK"],
-        "Length OK": features["Compliance"]["Length OK"],
-    }
+    result = {"Filename": os.path.basename(image_path), **row}
+    if cache_key is not None:
+        result_cache.put(cache_key, result, mask_uint8, width_vis)
+
+    return (result, mask_uint8, width_vis) if with_arrays else result
+
 
+def requantify(image_path, threshold=None, pixel_size_mm=0.1, per_crack=False, model_name="default"):
+    """
+    不再运行模型，直接重新量化：
+      threshold=None 时读取 mask_store 中已保存的掩膜（例如只改变 pixel_size_mm）；
+      给出 threshold 时用已保存的概率图按新阈值重新二值化（需先以 save_probability=True 处理过该图像），
+      结果图像会被覆盖为新阈值下的掩膜与宽度图。
+    概率图与当前图像内容或 model_name 的权重不一致（已过期）时报错，不会用旧概率图覆盖当前掩膜。
+    """
+    if threshold is None:
+        mask = mask_store.get(os.path.basename(image_path))
+        if mask is None:
+            raise FileNotFoundError(f"没有找到已保存的掩膜：{image_path}")
+        row, _ = quantify_mask(mask, pixel_size_mm, per_crack=per_crack)
+        return {"Filename": os.path.basename(image_path), **row}
+
+    prob = load_probability_map(image_path, model_name=model_name)
+    if prob is None:
+        raise FileNotFoundError(f"没有找到与当前图像和模型一致的概率图：{image_path}，"
+                                f"请先以 save_probability=True 重新处理该图像")
+    result = quantify_and_save(image_path, threshold_mask(prob, threshold), pixel_size_mm=pixel_size_mm,
+                               per_crack=per_crack)
+    result["Threshold"] = float(threshold)
     return result
 
 
+def threshold_sweep(image_path, thresholds=(0.3, 0.4, 0.5, 0.6, 0.7), pixel_size_mm=0.1, model_name="default"):
+    """
+    阈值扫描：对同一张已保存的概率图逐个阈值量化，返回每个阈值下的指标表（不写结果图像），
+    用于调节检测灵敏度或在不同阈值下重新做合规判定。
+    """
+    prob = load_probability_map(image_path, model_name=model_name)
+    if prob is None:
+        raise FileNotFoundError(f"没有找到与当前图像和模型一致的概率图：{image_path}，"
+                                f"请先以 save_probability=True 重新处理该图像")
+    rows = []
+    for threshold in thresholds:
+        mask_uint8 = (threshold_mask(prob, threshold) * 255).astype(np.uint8)
+        row, _ = quantify_mask(mask_uint8, pixel_size_mm)
+        rows.append({"Threshold": float(threshold), **row})
+    return pd.DataFrame(rows)
+
 
-def main(pixel_size_mm=0.1):
-    """批量处理 input_images 中所有图像并保存 CSV"""
+def run_params(pixel_size_mm=0.1, tiled=False, tile_size=896, stride=768, per_crack=False, model_name="default",
+               threshold=0.5) -> dict:
+    """影响结果的参数（记入清单与 results_store 的 runs 表），批处理与 ingest 流式入库共用"""
+    params = {"pixel_size_mm": float(pixel_size_mm), "tiled": bool(tiled), "per_crack": bool(per_crack),
+              "model": weights_hash(model_name), "threshold": float(threshold)}
+    if tiled:
+        params.update(tile_size=tile_size, stride=stride)
+    return params
+
+
+def main(pixel_size_mm=0.1, batch_size=8, tiled=False, tile_size=896, stride=768, per_crack=False,
+         use_cache=True, incremental=True, decode_workers=4, quant_workers=None, model_name="default",
+         threshold=0.5, save_probability=False, prob_dtype="uint8"):
+    """
+    批量处理 input_images 中所有图像（按 batch_size 分批推理），结果作为一次运行追加进
+    results_store（output/results.db），并导出 CSV。
+    tiled=True 时逐张按原始分辨率切片推理，适合大幅面图像。
+    per_crack=True 时另存逐条裂缝结果并导出到 output/result_cracks.csv。
+    use_cache=True 时内容与参数未变的图像直接取缓存结果，只有新增或改动的图像会重新推理。
+    incremental=True 时根据 output/manifest.json 只处理新增或改动的文件，CSV 导出每张图像的最新结果；
+    为 False 时全部重新处理，CSV 只含本次运行的结果，并重写清单。
+    decode_workers / quant_workers 分别为解码线程数和量化进程数（默认 CPU 核数 - 1）。
+    model_name 选择 crack_predict_code.predict.registry 中注册的模型。
+    threshold 为掩膜二值化阈值；save_probability=True 时把概率图另存到 output/probability，
+    之后可用 requantify / threshold_sweep 换阈值重新量化。
+    """
     input_dir = "input_images"
+    metrics_path, cracks_path = "output/result_metrics.csv", "output/result_cracks.csv"
     image_files = [f for f in os.listdir(input_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    results = []
-
-    for fname in image_files:
-        try:
-            path = os.path.join(input_dir, fname)
-            print(f"分析图像：{fname}")
-            result = process_image(path, pixel_size_mm=pixel_size_mm)
-            results.append(result)
-        except Exception as e:
-            print(f"❌ 处理 {fname} 失败：{e}")
-
-    # 保存所有结果
-    if results:
-        df = pd.DataFrame(results)
-        os.makedirs("output", exist_ok=True)
-        df.to_csv("output/result_metrics.csv", index=False)
-        print("✅ 所有结果已保存到 output/result_metrics.csv")
+
+    # 影响结果的参数写入清单，任一参数或模型权重变化都会触发重新处理
+    params = run_params(pixel_size_mm, tiled, tile_size, stride, per_crack, model_name, threshold)
+    manifest = load_manifest() if incremental else {}
+    done = results_store.filenames() if incremental else set()
+
+    mtimes = {f: entry.get("mtime") for f, entry in manifest.items()}
+    todo = [f for f in image_files
+            if not (f in done and is_up_to_date(manifest.get(f), os.path.join(input_dir, f), params))]
+    # 内容未变但被 touch 过的文件，is_up_to_date 已刷新其 mtime，这些条目也写回清单
+    changes = {f: entry for f, entry in manifest.items() if entry.get("mtime") != mtimes[f]}
+    print(f"📋 共 {len(image_files)} 张图像，需处理 {len(todo)} 张，跳过未变化的 {len(image_files) - len(todo)} 张")
+
+    # 处理前记录文件签名，处理期间文件若被改写，下次运行会再次处理
+    entries = {f: make_entry(os.path.join(input_dir, f), params) for f in todo}
+
+    # 解码/推理/量化/写盘流水线并行执行
+    run_id = results_store.start_run(params)
+    log_event("run_started", run_id=run_id, images=len(todo), **params)
+    paths = [os.path.join(input_dir, f) for f in todo]
+    results = run_pipeline(paths, pixel_size_mm=pixel_size_mm, batch_size=batch_size, tiled=tiled,
+                           tile_size=tile_size, stride=stride, per_crack=per_crack, use_cache=use_cache,
+                           decode_workers=decode_workers, quant_workers=quant_workers, model_name=model_name,
+                           threshold=threshold, save_probability=save_probability, prob_dtype=prob_dtype)
+
+    # 新结果追加进结果库（逐条裂缝结果写入 cracks 表，以 Filename 关联到图像）
+    results_store.add_results(run_id, results)
+    results_store.finish_run(run_id)
+
+    # CSV 作为导出格式保留：增量模式导出每张图像的最新结果，否则只导出本次运行的结果
+    export_run = None if incremental else run_id
+    with stage("csv_write"):
+        results_store.export_csv(metrics_path, run_id=export_run)
+    print(f"✅ 所有结果已保存到 {results_store.path}，并导出到 {metrics_path}")
+    if per_crack:
+        results_store.export_csv(cracks_path, run_id=export_run, cracks=True)
+        print(f"✅ 逐条裂缝结果已导出到 {cracks_path}")
+
+    # 只有成功处理的文件才记入清单；只合并本次的改动，其他进程同时写入的条目得以保留
+    for result in results:
+        changes[result["Filename"]] = entries[result["Filename"]]
+    update_manifest(changes, replace=not incremental)
+
+    # 各阶段耗时与计数写成 Prometheus 文本格式，便于跨运行对比
+    log_event("run_finished", run_id=run_id, images=len(results), failed=len(todo) - len(results))
+    print(f"⏱️ 阶段耗时指标已写入 {write_metrics_file()}")
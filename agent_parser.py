@@ -1,14 +1,16 @@
 import os
 import json
-from openai import OpenAI
+from llm_client import achat, chat
 from dotenv import load_dotenv
 
+from intent_router import route_intent
+
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def parse_user_intent(user_input: str) -> dict:
+def parse_user_intent(user_input: str, use_router: bool = True) -> dict:
     """
-    Use GPT to analyze user input and return structured tool call:
+    Routine commands are resolved locally by intent_router.route_intent (no network call);
+    otherwise use GPT to analyze user input and return structured tool call:
     {
         "tool": "<tool_name>",
         "parameters": {
@@ -17,7 +19,52 @@ def parse_user_intent(user_input: str) -> dict:
         }
     }
     """
-    prompt = f'''
+    if use_router:
+        routed = route_intent(user_input)
+        if routed is not None:
+            return routed
+
+    try:
+        response = chat([{"role": "user", "content": _intent_prompt(user_input)}], temperature=0,
+                        validate=_is_intent_json)
+        return json.loads(response.strip())
+    except Exception as e:
+        return {
+            "tool": None,
+            "parameters": {},
+            "error": f"{type(e).__name__}: {e}"
+        }
+
+
+async def aparse_user_intent(user_input: str, use_router: bool = True) -> dict:
+    """Async parse_user_intent for the asyncio agent core (same router, prompt and cache)."""
+    if use_router:
+        routed = route_intent(user_input)
+        if routed is not None:
+            return routed
+
+    try:
+        response = await achat([{"role": "user", "content": _intent_prompt(user_input)}], temperature=0,
+                               validate=_is_intent_json)
+        return json.loads(response.strip())
+    except Exception as e:
+        return {
+            "tool": None,
+            "parameters": {},
+            "error": f"{type(e).__name__}: {e}"
+        }
+
+
+def _is_intent_json(response: str) -> bool:
+    """Only replies that parse as a JSON object are cached; a malformed reply is retried next time."""
+    try:
+        return isinstance(json.loads(response.strip()), dict)
+    except ValueError:
+        return False
+
+
+def _intent_prompt(user_input: str) -> str:
+    return f'''
 You are an intelligent assistant for a crack analysis system.
 
 Your job is to:
@@ -117,21 +164,6 @@ Now process the following user request and output JSON only:
 """{user_input}"""
 '''
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
-        )
-        content = response.choices[0].message.content.strip()
-        return json.loads(content)
-    except Exception as e:
-        return {
-            "tool": None,
-            "parameters": {},
-            "error": f"{type(e).__name__}: {e}"
-        }
-
 
 def resolve_image_path(params: dict) -> str:
     """
@@ -1,17 +1,26 @@
+import os
 import gradio as gr
-from agent_executor import agent_respond
+from agent_executor import agent_respond_stream
+from instrumentation import configure_logging, start_metrics_server
 
-# UI 响应逻辑：支持记忆式 Agent 返回
+# 请求队列：同时处理的请求数与排队上限（超出时新请求直接提示繁忙）
+UI_CONCURRENCY = int(os.getenv("CRACK_UI_CONCURRENCY", "4"))
+UI_QUEUE_SIZE = int(os.getenv("CRACK_UI_QUEUE_SIZE", "32"))
 
-def run_interface(user_input):
-    response, paths = agent_respond(user_input)
-    return (
-        paths.get("original"), 
-        paths.get("mask"), 
-        paths.get("width"), 
-        None,  # 第四张图保留
-        response
-    )
+# UI 响应逻辑：支持记忆式 Agent 返回，回复逐段流式显示，图像直接以内存数组返回（不再读盘）
+
+async def run_interface(user_input, request: gr.Request):
+    # 每个浏览器会话各自保存上一张图像的分析结果，多人同时使用互不覆盖
+    images = {}
+    async for response, images in agent_respond_stream(user_input, with_arrays=True,
+                                                       session_id=request.session_hash):
+        yield (
+            images.get("original"),
+            images.get("mask"),
+            images.get("width"),
+            None,  # 第四张图保留
+            response
+        )
 
 with gr.Blocks(
     theme="soft",
@@ -60,5 +69,18 @@ with gr.Blocks(
         outputs=[img1, img2, img3, img4, output_text]
     )
 
+# 所有会话共用进程内同一个已加载的模型：启动时在后台预热，第一个请求无需等待加载
+def warmup_model():
+    from crack_predict_code.predict import registry
+    return registry.warmup("default", background=True)
+
+demo.queue(concurrency_count=UI_CONCURRENCY, max_size=UI_QUEUE_SIZE)
+
 if __name__ == "__main__":
+    # 可选：CRACK_LOG_FILE 输出逐阶段结构化日志，CRACK_METRICS_PORT 开放 /metrics 端点
+    if os.getenv("CRACK_LOG_FILE"):
+        configure_logging(os.getenv("CRACK_LOG_FILE"))
+    if os.getenv("CRACK_METRICS_PORT"):
+        start_metrics_server(int(os.getenv("CRACK_METRICS_PORT")))
+    warmup_model()
     demo.launch(share=True)
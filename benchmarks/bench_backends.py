@@ -0,0 +1,127 @@
+# benchmarks/bench_backends.py
+# 导出 TorchScript / ONNX 后，与 eager PyTorch 模型对比输出一致性和 CPU 推理延迟。
+# 用法：python -m benchmarks.bench_backends [--weights crack_predict_code/unet_best.pth] [--images 4] [--repeat 3]
+#        [--random-weights]
+# 一致性不达标（掩膜不一致像素比例超过 --tolerance，或 logits 相对误差超过 --logit-tolerance）时以非零状态码退出，
+# 可作为导出后的校验步骤。
+# 没有训练好的权重时加 --random-weights：随机初始化 UNet 并随机化 BatchNorm 的统计量和仿射参数
+# （否则 BN 为恒等变换，折叠不改变权重），input-dir 中没有图像时改用随机噪声图，离线即可校验 BN 折叠与导出。
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+
+from crack_detection_model.export import export_onnx, export_torchscript, fold_batchnorm, load_unet
+from crack_detection_model.unet import UNet
+from crack_predict_code.predict import preprocess, registry, run_prediction_tensors
+
+
+def _load_images(folder, limit):
+    if not os.path.isdir(folder):
+        return []
+    names = sorted(f for f in os.listdir(folder) if f.lower().endswith(('.png', '.jpg', '.jpeg')))[:limit]
+    return [cv2.imread(os.path.join(folder, name)) for name in names]
+
+
+def _random_unet(path, seed=0):
+    """随机初始化的 UNet，BatchNorm 的 running_mean/var 和 weight/bias 也随机化，保存到 path"""
+    torch.manual_seed(seed)
+    model = UNet(in_channels=3, num_classes=1)
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm2d):
+                module.running_mean.uniform_(-0.5, 0.5)
+                module.running_var.uniform_(0.5, 2.0)
+                module.weight.uniform_(0.5, 1.5)
+                module.bias.uniform_(-0.2, 0.2)
+    torch.save(model.state_dict(), path)
+    return model.eval()
+
+
+def _check_folding_changes_weights(model):
+    """确认 BN 折叠确实改写了卷积权重，否则一致性对比校验不到折叠本身"""
+    original = next(m for m in model.modules() if isinstance(m, nn.Conv2d)).weight
+    folded = next(m for m in fold_batchnorm(model).modules() if isinstance(m, nn.Conv2d)).weight
+    if torch.allclose(original, folded):
+        sys.exit("❌ BatchNorm 折叠没有改变卷积权重，无法校验折叠")
+
+
+def _median_latency(model_name, tensors, repeat):
+    run_prediction_tensors(tensors[:1], model_name=model_name)  # 预热
+    timings = []
+    for _ in range(repeat):
+        for tensor in tensors:
+            start = time.perf_counter()
+            run_prediction_tensors([tensor], model_name=model_name)
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="eager / TorchScript / ONNX Runtime 一致性与延迟对比")
+    parser.add_argument("--weights", default=registry.weights_path("default"))
+    parser.add_argument("--input-dir", default="input_images")
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="允许的掩膜不一致像素比例")
+    parser.add_argument("--logit-tolerance", type=float, default=1e-3,
+                        help="允许的 logits 最大误差（相对于 eager logits 的最大绝对值）")
+    parser.add_argument("--random-weights", action="store_true",
+                        help="使用随机初始化（含随机 BN 统计量）的 UNet，离线、无权重文件时校验折叠与导出")
+    args = parser.parse_args()
+
+    images = _load_images(args.input_dir, args.images)
+    if not images and args.random_weights:
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 256, (512, 512, 3), dtype=np.uint8) for _ in range(max(args.images, 1))]
+    tensors = [preprocess(img) for img in images]
+    if not tensors:
+        sys.exit(f"❌ {args.input_dir} 中没有图像")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.random_weights:
+            args.weights = os.path.join(tmp, "unet_random.pth")
+            model = _random_unet(args.weights)
+            _check_folding_changes_weights(model)
+        else:
+            model = load_unet(args.weights)
+        ts_path = export_torchscript(model, os.path.join(tmp, "unet.pt"))
+        onnx_path = export_onnx(model, os.path.join(tmp, "unet.onnx"))
+        registry.register("bench-eager", args.weights, backend="torch")
+        registry.register("bench-torchscript", ts_path, backend="torchscript")
+        registry.register("bench-onnx", onnx_path, backend="onnx")
+
+        variants = ["bench-eager", "bench-torchscript", "bench-onnx"]
+        reference = run_prediction_tensors(tensors, model_name="bench-eager")
+        with torch.no_grad():
+            ref_logits = registry.get("bench-eager")(torch.stack(tensors))
+
+        ok = True
+        baseline = None
+        ref_scale = max(float(ref_logits.abs().max()), 1.0)
+        for name in variants:
+            masks = run_prediction_tensors(tensors, model_name=name)
+            mismatch = float(np.mean([np.mean(m != r) for m, r in zip(masks, reference)]))
+            with torch.no_grad():
+                logits = registry.get(name)(torch.stack(tensors))
+            max_diff = float((logits.float() - ref_logits).abs().max())
+            latency = _median_latency(name, tensors, args.repeat)
+            baseline = baseline or latency
+            passed = mismatch <= args.tolerance and max_diff <= args.logit_tolerance * ref_scale
+            ok &= passed
+            print(f"{name:<18} latency={latency * 1000:8.1f}ms  speedup={baseline / latency:4.2f}x  "
+                  f"mask_mismatch={mismatch:.2e}  max_logit_diff={max_diff:.2e}  {'✅' if passed else '❌'}")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
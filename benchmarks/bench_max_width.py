@@ -0,0 +1,80 @@
+# benchmarks/bench_max_width.py
+# 对比 visualize_max_width 的批量近邻查询实现与旧的逐点循环实现：结果一致性与耗时。
+# 用法：python -m benchmarks.bench_max_width [--size 896] [--cracks 5] [--repeat 3]
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+from scipy.spatial import cKDTree
+
+from benchmarks.synthetic import synthetic_crack_mask
+from crack_quantification.quantifier import analyze_mask, visualize_max_width
+
+
+def legacy_visualize_max_width(image, analysis):
+    """旧实现：对每个骨架点单独调用一次 cKDTree.query（仅作基准对照）"""
+    binary, skeleton, contours = analysis.binary, analysis.skeleton, analysis.contours
+    if not contours:
+        return np.zeros_like(image), 0.0
+
+    contour_pts = np.vstack([c.reshape(-1, 2) for c in contours])
+    tree = cKDTree(contour_pts)
+    max_dist, pt1, pt2 = 0, None, None
+
+    for y, x in np.argwhere(skeleton):
+        dists, idxs = tree.query([x, y], k=2)
+        if len(idxs) == 2:
+            p1, p2 = contour_pts[idxs[0]], contour_pts[idxs[1]]
+            dist = np.linalg.norm(p1 - p2)
+            if dist > max_dist:
+                max_dist, pt1, pt2 = dist, p1, p2
+
+    output = cv2.cvtColor((binary * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+    if pt1 is not None and pt2 is not None:
+        cv2.line(output, tuple(pt1), tuple(pt2), (0, 0, 255), 2)
+
+    return output, max_dist
+
+
+def _best_time(fn, repeat):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="visualize_max_width 批量查询 vs 逐点循环")
+    parser.add_argument("--size", type=int, default=896)
+    parser.add_argument("--cracks", type=int, default=5)
+    parser.add_argument("--seeds", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    total_old, total_new, mismatches = 0.0, 0.0, 0
+    for seed in range(args.seeds):
+        mask = synthetic_crack_mask(args.size, args.size, num_cracks=args.cracks, seed=seed)
+        analysis = analyze_mask(mask)
+        _ = analysis.contours  # 轮廓计算不计入两边耗时
+
+        t_old, (vis_old, dist_old) = _best_time(lambda: legacy_visualize_max_width(mask, analysis), args.repeat)
+        t_new, (vis_new, dist_new) = _best_time(lambda: visualize_max_width(mask, analysis=analysis), args.repeat)
+
+        same = np.isclose(dist_old, dist_new) and np.array_equal(vis_old, vis_new)
+        mismatches += not same
+        total_old += t_old
+        total_new += t_new
+        print(f"seed={seed} skeleton_px={int(analysis.skeleton.sum())} "
+              f"loop={t_old * 1000:.1f}ms bulk={t_new * 1000:.1f}ms "
+              f"max_dist={float(dist_new):.2f} {'✅ 一致' if same else '❌ 不一致'}")
+
+    print(f"合计：loop={total_old * 1000:.1f}ms bulk={total_new * 1000:.1f}ms "
+          f"加速 {total_old / max(total_new, 1e-9):.1f}x，不一致 {mismatches} 个")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# benchmarks/bench_pipeline.py
+# 端到端基准：逐阶段计时 解码 → 预处理 → UNet 前向 → 阈值 → thin → 距离变换 → visualize_max_width → 写盘，
+# 输出各阶段 p50/p95 延迟、吞吐量和峰值 RSS（JSON），可跨提交对比性能回归或提升。
+# 用法：python -m benchmarks.bench_pipeline [--input-dir input_images] [--images 10] [--synthetic 10]
+#        [--synthetic-size 896] [--synthetic-cracks 5] [--repeat 3] [--random-weights] [--output bench.json]
+# 不需要联网；没有训练好的权重时可加 --random-weights 使用随机初始化的 UNet。前向计算耗时与权重无关，
+# 但随机权重得到的掩膜与真实裂缝差别很大，thin、最大宽度、写盘等下游阶段的耗时不能与真实权重的报告直接比较，
+# 因此报告 config 中记录 random_weights。
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+import pandas as pd
+import torch
+from skimage.morphology import thin
+
+from benchmarks.synthetic import synthetic_crack_mask
+from crack_predict_code.predict import INPUT_SIZE, _input_buffer, preprocess, registry, run_probability_tensors, \
+    threshold_mask
+from crack_quantification.quantifier import analyze_mask, binarize, quantify_mask, visualize_max_width
+from mask_store import MaskStore
+from results_store import ResultsStore
+
+
+class StageTimer:
+    """按阶段累计每次调用的耗时"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def run(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.samples[stage].append(time.perf_counter() - start)
+        return result
+
+    def report(self):
+        report = {}
+        for stage, values in self.samples.items():
+            values = np.asarray(values)
+            report[stage] = {
+                "count": int(values.size),
+                "total_s": round(float(values.sum()), 4),
+                "mean_ms": round(float(values.mean()) * 1000, 3),
+                "p50_ms": round(float(np.percentile(values, 50)) * 1000, 3),
+                "p95_ms": round(float(np.percentile(values, 95)) * 1000, 3),
+            }
+        return report
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def to_mask(prob, threshold):
+    return (threshold_mask(prob, threshold) * 255).astype(np.uint8)
+
+
+def quantify_stages(timer, mask_uint8, pixel_size_mm):
+    """量化相关阶段：thin、距离变换、最大宽度可视化，以及完整的 quantify_mask"""
+    binary = binarize(mask_uint8)
+    timer.run("thin", thin, binary)
+    timer.run("distance_transform", cv2.distanceTransform, (binary * 255).astype(np.uint8), cv2.DIST_L2, 5)
+    analysis = analyze_mask(mask_uint8)
+    timer.run("visualize_max_width", visualize_max_width, mask_uint8, analysis=analysis)
+    row, width_vis = timer.run("quantify_total", quantify_mask, mask_uint8, pixel_size_mm)
+    return row, width_vis
+
+
+def write_stages(timer, out_dir, name, mask_uint8, width_vis, mask_store):
+    base = os.path.splitext(name)[0]
+    timer.run("png_write", cv2.imwrite, os.path.join(out_dir, f"{base}_mask.png"), mask_uint8)
+    if width_vis is not None:
+        timer.run("png_write", cv2.imwrite, os.path.join(out_dir, f"{base}_width.png"), width_vis)
+    timer.run("mask_store_put", mask_store.put, name, mask_uint8, flush=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分割 + 量化流水线端到端逐阶段基准")
+    parser.add_argument("--input-dir", default="input_images")
+    parser.add_argument("--images", type=int, default=10, help="使用 input-dir 中的前 N 张图像（0 表示不用真实图像）")
+    parser.add_argument("--synthetic", type=int, default=10, help="额外生成的合成裂缝掩膜数量（只跑量化与写盘阶段）")
+    parser.add_argument("--synthetic-size", type=int, default=896)
+    parser.add_argument("--synthetic-cracks", type=int, default=5, help="每张合成掩膜的裂缝条数（密度）")
+    parser.add_argument("--synthetic-thickness", type=int, default=8)
+    parser.add_argument("--pixel-size", type=float, default=0.1)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--model", default="default", help="predict.registry 中的模型名")
+    parser.add_argument("--random-weights", action="store_true", help="使用随机初始化的 UNet（离线、无权重文件时）")
+    parser.add_argument("--output", default=None, help="JSON 报告另存路径")
+    args = parser.parse_args()
+
+    names = []
+    if args.images > 0 and os.path.isdir(args.input_dir):
+        names = sorted(f for f in os.listdir(args.input_dir)
+                       if f.lower().endswith(('.png', '.jpg', '.jpeg')))[:args.images]
+    synthetic = [synthetic_crack_mask(args.synthetic_size, args.synthetic_size, args.synthetic_cracks,
+                                      args.synthetic_thickness, seed=i) for i in range(args.synthetic)]
+
+    timer = StageTimer()
+    wall = defaultdict(float)
+    with tempfile.TemporaryDirectory() as tmp:
+        model_name = args.model
+        if args.random_weights and names:
+            from crack_detection_model.unet import UNet
+            torch.manual_seed(0)
+            weights = os.path.join(tmp, "unet_random.pth")
+            torch.save(UNet(in_channels=3, num_classes=1).state_dict(), weights)
+            model_name = "bench-random"
+            registry.register(model_name, weights)
+
+        mask_store = MaskStore(os.path.join(tmp, "masks"))
+        results_store = ResultsStore(os.path.join(tmp, "results.db"))
+        if names:
+            run_probability_tensors([preprocess(np.zeros((64, 64, 3), dtype=np.uint8))], model_name=model_name)  # 预热
+
+        for _ in range(args.repeat):
+            rows = []
+            start = time.perf_counter()
+            for name in names:
+                with open(os.path.join(args.input_dir, name), "rb") as f:
+                    data = timer.run("read", f.read)
+                image = timer.run("decode", cv2.imdecode, np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                buf = _input_buffer(1)
+                timer.run("preprocess", preprocess, image, out=buf[0])
+                prob = timer.run("forward", run_probability_tensors, [buf[0].permute(2, 0, 1)], model_name=model_name)[0]
+                mask_uint8 = timer.run("threshold", to_mask, prob, args.threshold)
+                row, width_vis = quantify_stages(timer, mask_uint8, args.pixel_size)
+                write_stages(timer, tmp, name, mask_uint8, width_vis, mask_store)
+                rows.append({"Filename": name, **row})
+            wall["images"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for i, mask_uint8 in enumerate(synthetic):
+                name = f"synthetic_{i}.png"
+                row, width_vis = quantify_stages(timer, mask_uint8, args.pixel_size)
+                write_stages(timer, tmp, name, mask_uint8, width_vis, mask_store)
+                rows.append({"Filename": name, **row})
+            wall["synthetic"] += time.perf_counter() - start
+
+            timer.run("mask_store_flush", mask_store.flush)
+            timer.run("csv_write", pd.DataFrame(rows).to_csv, os.path.join(tmp, "result_metrics.csv"), index=False)
+            run_id = results_store.start_run({"pixel_size_mm": args.pixel_size, "threshold": args.threshold})
+            timer.run("results_store_write", results_store.add_results, run_id, rows)
+        results_store.close()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(), "numpy": np.__version__, "torch": torch.__version__,
+            "opencv": cv2.__version__, "cpu_count": os.cpu_count(), "platform": platform.platform(),
+            "device": "cuda" if torch.cuda.is_available() else "cpu",
+        },
+        "config": {
+            "images": len(names), "synthetic": len(synthetic), "synthetic_size": args.synthetic_size,
+            "synthetic_cracks": args.synthetic_cracks, "input_size": list(INPUT_SIZE), "repeat": args.repeat,
+            "pixel_size_mm": args.pixel_size, "threshold": args.threshold, "model": model_name,
+            "random_weights": bool(args.random_weights and names),
+        },
+        "stages": timer.report(),
+        "throughput_per_s": {
+            "images_end_to_end": round(len(names) * args.repeat / wall["images"], 3) if names and wall["images"] else None,
+            "synthetic_quantify": (round(len(synthetic) * args.repeat / wall["synthetic"], 3)
+                                   if synthetic and wall["synthetic"] else None),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
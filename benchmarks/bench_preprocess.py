@@ -0,0 +1,81 @@
+# benchmarks/bench_preprocess.py
+# 对比旧的 PIL + torchvision 预处理与现在的 OpenCV/NumPy 预处理：延迟、内存分配和数值差异。
+# 用法：python -m benchmarks.bench_preprocess [--input-dir input_images] [--scale 1.0] [--repeat 20]
+# 内存分配用 tracemalloc 统计（可追踪 NumPy 缓冲；PIL / torch 内部分配不计入，旧实现的实际占用只会更高）。
+
+import argparse
+import os
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import torch
+
+from crack_predict_code.predict import INPUT_SIZE, _input_buffer, preprocess
+
+
+def legacy_preprocess():
+    """旧实现：BGR→RGB → PIL → torchvision Resize → ToTensor（仅作基准对照）"""
+    from PIL import Image as PILImage
+    from torchvision import transforms
+
+    transform = transforms.Compose([transforms.Resize(INPUT_SIZE), transforms.ToTensor()])
+
+    def run(image_np):
+        pil_img = PILImage.fromarray(cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB)).convert("RGB")
+        return transform(pil_img)
+
+    return run
+
+
+def _measure(fn, images, repeat):
+    fn(images[0])  # 预热
+    timings = []
+    tracemalloc.start()
+    for _ in range(repeat):
+        for image in images:
+            start = time.perf_counter()
+            fn(image)
+            timings.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return float(np.median(timings)), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预处理：PIL/torchvision vs OpenCV/NumPy")
+    parser.add_argument("--input-dir", default="input_images")
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="先把测试图像缩放到原尺寸的倍数，模拟不同输入分辨率")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    names = sorted(f for f in os.listdir(args.input_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    images = [cv2.imread(os.path.join(args.input_dir, name)) for name in names[:args.images]]
+    if args.scale != 1.0:
+        images = [cv2.resize(img, None, fx=args.scale, fy=args.scale) for img in images]
+
+    legacy = legacy_preprocess()
+    buf = _input_buffer(1)
+    variants = {
+        "PIL + torchvision": legacy,
+        "cv2 (新分配)": preprocess,
+        "cv2 (复用缓冲)": lambda img: preprocess(img, out=buf[0]),
+    }
+
+    print(f"输入 {images[0].shape[1]}×{images[0].shape[0]} → {INPUT_SIZE[1]}×{INPUT_SIZE[0]}，"
+          f"{len(images)} 张 × {args.repeat} 次")
+    baseline = None
+    for name, fn in variants.items():
+        latency, peak = _measure(fn, images, args.repeat)
+        baseline = baseline or latency
+        print(f"{name:<20} median={latency * 1000:7.2f}ms  speedup={baseline / latency:5.2f}x  "
+              f"traced_peak={peak / 1024 ** 2:7.2f}MB")
+
+    diffs = [float(torch.max(torch.abs(legacy(img) - preprocess(img)))) for img in images]
+    print(f"与旧实现的最大像素差：{max(diffs):.4f}（输入尺寸等于 {INPUT_SIZE} 时为 0，缩放时插值方式不同）")
+
+
+if __name__ == "__main__":
+    main()
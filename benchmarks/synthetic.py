@@ -0,0 +1,23 @@
+# benchmarks/synthetic.py
+
+import numpy as np
+import cv2
+
+
+def synthetic_crack_mask(height=896, width=896, num_cracks=5, max_thickness=8, seed=0):
+    """
+    生成随机游走折线构成的合成裂缝掩膜 (np.ndarray, HW, uint8)，值为0或255。
+    尺寸、裂缝条数和最大线宽均可配置，固定 seed 时结果可复现。
+    """
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    step = max(min(height, width) / 60.0, 1.0)
+
+    for _ in range(num_cracks):
+        start = rng.uniform(0, [width, height])
+        pts = np.cumsum(rng.normal(0, step, (40, 2)), axis=0) + start
+        pts = np.clip(pts, 0, [width - 1, height - 1]).astype(np.int32).reshape(-1, 1, 2)
+        thickness = int(rng.integers(2, max(max_thickness, 2) + 1))
+        cv2.polylines(mask, [pts], False, 255, thickness)
+
+    return mask
@@ -0,0 +1,92 @@
+import argparse
+import copy
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from crack_detection_model.unet import UNet
+
+
+def fold_batchnorm(model: nn.Module) -> nn.Module:
+    """
+    返回一个 eval 模式的副本，把每个 Conv2d 后紧跟的 BatchNorm2d 折叠进卷积的权重和偏置。
+    推理结果不变，但每个 DoubleConv 少了两次逐元素的归一化计算。
+    """
+    model = copy.deepcopy(model).eval()
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        layers = list(module)
+        fused, i = [], 0
+        while i < len(layers):
+            layer = layers[i]
+            if (isinstance(layer, nn.Conv2d) and i + 1 < len(layers)
+                    and isinstance(layers[i + 1], nn.BatchNorm2d)):
+                fused.append(fuse_conv_bn_eval(layer, layers[i + 1]))
+                i += 2
+            else:
+                fused.append(layer)
+                i += 1
+        if len(fused) != len(layers):
+            for name in list(module._modules):
+                del module._modules[name]
+            for idx, layer in enumerate(fused):
+                module.add_module(str(idx), layer)
+    return model
+
+
+def export_torchscript(model: nn.Module, path: str, input_size=(1, 3, 896, 896)) -> str:
+    """折叠 BN 后 trace 并 freeze 成 TorchScript 模块，保存到 path"""
+    model = fold_batchnorm(model)
+    example = torch.zeros(*input_size)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(model, example))
+    scripted.save(path)
+    return path
+
+
+def export_onnx(model: nn.Module, path: str, input_size=(1, 3, 896, 896), opset: int = 17) -> str:
+    """
+    折叠 BN 后导出 ONNX 图，batch、高、宽均为动态维度（高宽需为 16 的倍数），
+    可配合 onnxruntime 的 CPUExecutionProvider 推理。
+    """
+    model = fold_batchnorm(model)
+    example = torch.zeros(*input_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, example, path,
+            input_names=["image"], output_names=["logits"],
+            dynamic_axes={"image": {0: "batch", 2: "height", 3: "width"},
+                          "logits": {0: "batch", 2: "height", 3: "width"}},
+            opset_version=opset,
+            dynamo=False,
+        )
+    return path
+
+
+def load_unet(weights_path: str) -> nn.Module:
+    model = UNet(in_channels=3, num_classes=1)
+    model.load_state_dict(torch.load(weights_path, map_location="cpu"))
+    return model.eval()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 UNet 为 TorchScript / ONNX（BatchNorm 已折叠）")
+    parser.add_argument("--weights", default="crack_predict_code/unet_best.pth")
+    parser.add_argument("--format", choices=["torchscript", "onnx"], required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--size", type=int, default=896, help="导出时示例输入的边长")
+    args = parser.parse_args()
+
+    model = load_unet(args.weights)
+    input_size = (1, 3, args.size, args.size)
+    if args.format == "torchscript":
+        export_torchscript(model, args.output, input_size)
+    else:
+        export_onnx(model, args.output, input_size)
+    print(f"✅ 已导出 {args.format}：{args.output}")
+
+
+if __name__ == "__main__":
+    main()
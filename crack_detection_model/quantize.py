@@ -0,0 +1,162 @@
+import argparse
+import copy
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import (
+    DeQuantStub, QConfig, QuantStub, convert, default_observer, default_weight_observer,
+    fuse_modules, get_default_qconfig, prepare,
+)
+
+from crack_detection_model.unet import DoubleConv, UNet
+
+
+class QuantizableUNet(UNet):
+    """
+    可做静态 INT8 量化的 UNet：结构和权重与 UNet 相同，
+    输入/输出加量化/反量化桩，跳连的 torch.cat 换成 FloatFunctional，以便量化后在 INT8 域中拼接。
+    """
+
+    def __init__(self, in_channels=3, num_classes=1):
+        super().__init__(in_channels, num_classes)
+        self.quant = QuantStub()
+        self.dequant = DeQuantStub()
+        self.cat4 = nn.quantized.FloatFunctional()
+        self.cat3 = nn.quantized.FloatFunctional()
+        self.cat2 = nn.quantized.FloatFunctional()
+        self.cat1 = nn.quantized.FloatFunctional()
+
+    def forward(self, x):
+        x = self.quant(x)
+        d1 = self.down1(x)
+        d2 = self.down2(self.pool(d1))
+        d3 = self.down3(self.pool(d2))
+        d4 = self.down4(self.pool(d3))
+        b = self.bottom(self.pool(d4))
+
+        u4 = self.conv4(self.cat4.cat([self.up4(b), d4], dim=1))
+        u3 = self.conv3(self.cat3.cat([self.up3(u4), d3], dim=1))
+        u2 = self.conv2(self.cat2.cat([self.up2(u3), d2], dim=1))
+        u1 = self.conv1(self.cat1.cat([self.up1(u2), d1], dim=1))
+
+        return self.dequant(self.out(u1))
+
+
+def fuse_double_convs(model: nn.Module) -> nn.Module:
+    """把每个 DoubleConv 中的 Conv+BN+ReLU 融合为单个模块（需在 eval 模式下调用，原地修改）"""
+    for module in model.modules():
+        if isinstance(module, DoubleConv):
+            fuse_modules(module.conv, [["0", "1", "2"], ["3", "4", "5"]], inplace=True)
+    return model
+
+
+def quantize_unet(float_model: nn.Module, calibration_tensors, engine: str = None) -> nn.Module:
+    """
+    静态训练后量化（PTQ）：融合 Conv+BN+ReLU → 插入观察器 → 用校准数据前向统计激活范围 → 转换为 INT8。
+    calibration_tensors 为预处理后的输入张量（CHW 或 NCHW）的可迭代对象，建议取若干张有代表性的现场图像。
+    返回的量化模型只能在 CPU 上运行。
+    """
+    engine = engine or ("x86" if "x86" in torch.backends.quantized.supported_engines else "fbgemm")
+    torch.backends.quantized.engine = engine
+
+    model = QuantizableUNet(in_channels=3, num_classes=1)
+    model.load_state_dict(copy.deepcopy(float_model.state_dict()))
+    model.eval()
+    fuse_double_convs(model)
+
+    model.qconfig = get_default_qconfig(engine)
+    # 反卷积只支持按张量量化的权重
+    per_tensor = QConfig(activation=default_observer, weight=default_weight_observer)
+    for up in (model.up4, model.up3, model.up2, model.up1):
+        up.qconfig = per_tensor
+
+    prepare(model, inplace=True)
+    with torch.no_grad():
+        for tensor in calibration_tensors:
+            model(tensor if tensor.dim() == 4 else tensor.unsqueeze(0))
+    convert(model, inplace=True)
+    return model
+
+
+def save_quantized(model: nn.Module, path: str, input_size=(1, 3, 896, 896)) -> str:
+    """trace 为 TorchScript 保存，可用 predict.registry.register(..., backend="int8") 加载"""
+    with torch.no_grad():
+        scripted = torch.jit.trace(model, torch.zeros(*input_size))
+    scripted.save(path)
+    return path
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def iou_drift(float_model, int8_model, tensors, threshold: float = 0.5) -> dict:
+    """
+    量化精度漂移报告：同一批输入上 FP32 与 INT8 掩膜的逐张 IoU 和不一致像素比例，
+    以及两者的平均单张推理耗时。
+    """
+    ious, mismatches, fp32_times, int8_times = [], [], [], []
+    with torch.no_grad():
+        for tensor in tensors:
+            x = tensor if tensor.dim() == 4 else tensor.unsqueeze(0)
+
+            start = time.perf_counter()
+            ref = torch.sigmoid(float_model(x)) > threshold
+            fp32_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            out = torch.sigmoid(int8_model(x)) > threshold
+            int8_times.append(time.perf_counter() - start)
+
+            ref, out = ref.numpy(), out.numpy()
+            ious.append(mask_iou(ref, out))
+            mismatches.append(float(np.mean(ref != out)))
+
+    return {
+        "images": len(ious),
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "min_iou": float(np.min(ious)) if ious else None,
+        "mean_mismatch": float(np.mean(mismatches)) if mismatches else None,
+        "fp32_latency_s": float(np.mean(fp32_times)) if fp32_times else None,
+        "int8_latency_s": float(np.mean(int8_times)) if int8_times else None,
+    }
+
+
+def main():
+    # 校准与评估使用和线上推理完全相同的预处理
+    from crack_predict_code.predict import preprocess
+    from crack_detection_model.export import load_unet
+
+    parser = argparse.ArgumentParser(description="UNet 静态 INT8 训练后量化，并报告相对 FP32 的 IoU 漂移")
+    parser.add_argument("--weights", default="crack_predict_code/unet_best.pth")
+    parser.add_argument("--calib-dir", default="input_images", help="校准图像文件夹")
+    parser.add_argument("--calib-images", type=int, default=8)
+    parser.add_argument("--eval-dir", default=None, help="评估 IoU 漂移的图像文件夹，默认与校准相同")
+    parser.add_argument("--output", default="crack_predict_code/unet_int8.pt")
+    args = parser.parse_args()
+
+    def load_tensors(folder, limit=None):
+        names = sorted(f for f in os.listdir(folder) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+        return [preprocess(cv2.imread(os.path.join(folder, name))) for name in names[:limit]]
+
+    float_model = load_unet(args.weights)
+    calib = load_tensors(args.calib_dir, args.calib_images)
+    print(f"🔧 使用 {len(calib)} 张图像校准：{args.calib_dir}")
+    int8_model = quantize_unet(float_model, calib)
+    save_quantized(int8_model, args.output)
+    print(f"✅ INT8 模型已保存：{args.output}")
+
+    report = iou_drift(float_model, int8_model, load_tensors(args.eval_dir or args.calib_dir))
+    print(f"📊 IoU 漂移：平均 IoU {report['mean_iou']:.4f}，最低 IoU {report['min_iou']:.4f}，"
+          f"不一致像素 {report['mean_mismatch']:.2e}")
+    print(f"⏱️ 单张耗时：FP32 {report['fp32_latency_s']:.3f}s，INT8 {report['int8_latency_s']:.3f}s，"
+          f"加速 {report['fp32_latency_s'] / report['int8_latency_s']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
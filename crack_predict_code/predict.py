@@ -1,37 +1,369 @@
 # crack_predict_code/predict.py
 
+import os
+import hashlib
+import threading
 import torch
 import numpy as np
-from torchvision import transforms
-from PIL import Image as PILImage
 from crack_detection_model.unet import UNet
 import cv2
+from instrumentation import stage, timed
 
-# 初始化模型（只加载一次）
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-model = UNet(in_channels=3, num_classes=1)
-model.load_state_dict(torch.load(r"crack_predict_code\unet_best.pth", map_location=device))  # <-- 确保路径正确
-model.to(device)
-model.eval()
+# 默认权重路径与推理后端，可用环境变量 CRACK_MODEL_WEIGHTS / CRACK_MODEL_BACKEND 覆盖
+DEFAULT_WEIGHTS_PATH = os.getenv(
+    "CRACK_MODEL_WEIGHTS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "unet_best.pth"),
+)
 
-# 定义图像预处理
-transform = transforms.Compose([
-    transforms.Resize((896, 896)),
-    transforms.ToTensor()
-])
+# 模型输入尺寸 (H, W)
+INPUT_SIZE = (896, 896)
 
-def run_prediction(image_np: np.ndarray) -> np.ndarray:
+class OnnxRuntimeModel:
+    """
+    onnxruntime 会话的包装，调用方式与 torch 模型一致：输入/输出均为 NCHW torch.Tensor。
+    只使用 CPUExecutionProvider。onnxruntime 为可选依赖，仅在使用 onnx 后端时导入。
+    """
+
+    def __init__(self, path: str):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("onnx 后端需要安装 onnxruntime：pip install onnxruntime") from e
+        self.session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, input_tensor: torch.Tensor) -> torch.Tensor:
+        image = np.ascontiguousarray(input_tensor.detach().cpu().numpy())
+        outputs = self.session.run(None, {self.input_name: image})
+        return torch.from_numpy(outputs[0])
+
+def _load_torch(path):
+    model = UNet(in_channels=3, num_classes=1)
+    model.load_state_dict(torch.load(path, map_location=device))
+    model.to(device)
+    model.eval()
+    return model
+
+def _load_torchscript(path):
+    # crack_detection_model.export.export_torchscript 导出的已 freeze 模块
+    return torch.jit.load(path, map_location=device).eval()
+
+def _load_onnx(path):
+    # crack_detection_model.export.export_onnx 导出的 ONNX 图
+    return OnnxRuntimeModel(path)
+
+class Int8Model:
+    """静态 INT8 量化模型的包装：量化算子只能在 CPU 上运行，输入先搬到 CPU"""
+
+    def __init__(self, path: str):
+        engines = torch.backends.quantized.supported_engines
+        torch.backends.quantized.engine = "x86" if "x86" in engines else "fbgemm"
+        self.module = torch.jit.load(path, map_location="cpu").eval()
+
+    def __call__(self, input_tensor: torch.Tensor) -> torch.Tensor:
+        return self.module(input_tensor.cpu())
+
+def _load_int8(path):
+    # crack_detection_model.quantize 生成的 INT8 TorchScript 模型
+    return Int8Model(path)
+
+BACKENDS = {
+    "torch": _load_torch,
+    "torchscript": _load_torchscript,
+    "onnx": _load_onnx,
+    "int8": _load_int8,
+}
+
+class ModelRegistry:
+    """
+    延迟加载的模型注册表：register 只记录权重路径和推理后端，模型在第一次 get 时才构建并加载，
+    之后常驻内存复用。可同时注册多个模型变体，推理函数通过 model_name 按调用选择。
+    后端见 BACKENDS：torch（eager，state_dict 权重）、torchscript（冻结模块）、onnx（onnxruntime CPU）、
+    int8（静态量化的 TorchScript，仅 CPU）。
+    """
+
+    def __init__(self):
+        self._weights = {}
+        self._backends = {}
+        self._models = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, weights_path: str, backend: str = "torch"):
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的推理后端：{backend}（可选：{', '.join(BACKENDS)}）")
+        with self._lock:
+            self._weights[name] = weights_path
+            self._backends[name] = backend
+            self._models.pop(name, None)
+            self._hashes.pop(name, None)
+
+    def names(self) -> list:
+        return sorted(self._weights)
+
+    def is_loaded(self, name: str = "default") -> bool:
+        return name in self._models
+
+    def weights_path(self, name: str = "default") -> str:
+        if name not in self._weights:
+            raise KeyError(f"未注册的模型：{name}（已注册：{', '.join(self.names()) or '无'}）")
+        return self._weights[name]
+
+    def backend(self, name: str = "default") -> str:
+        self.weights_path(name)
+        return self._backends[name]
+
+    def get(self, name: str = "default"):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            # 双重检查，避免多个线程同时加载同一个模型
+            if name not in self._models:
+                weights_path = self.weights_path(name)
+                backend = self._backends[name]
+                print(f"📦 加载模型 {name}（{backend}）：{weights_path}")
+                self._models[name] = BACKENDS[backend](weights_path)
+            return self._models[name]
+
+    def weights_hash(self, name: str = "default") -> str:
+        """模型权重文件的 SHA-256（每个模型只计算一次），用作结果缓存键的一部分"""
+        if name not in self._hashes:
+            digest = hashlib.sha256()
+            with open(self.weights_path(name), "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            self._hashes[name] = digest.hexdigest()
+        return self._hashes[name]
+
+    def warmup(self, name: str = "default", background: bool = True):
+        """
+        预先加载模型并做一次小尺寸前向，初始化算子。
+        background=True 时在后台线程执行并返回该线程，不阻塞启动。
+        """
+        def run():
+            model = self.get(name)
+            with torch.no_grad():
+                model(torch.zeros(1, 3, 64, 64, device=device))
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name=f"warmup-{name}", daemon=True)
+        thread.start()
+        return thread
+
+# 全局注册表：导入本模块时不加载任何权重
+registry = ModelRegistry()
+registry.register("default", DEFAULT_WEIGHTS_PATH, backend=os.getenv("CRACK_MODEL_BACKEND", "torch"))
+
+def get_model(name: str = "default"):
+    return registry.get(name)
+
+def weights_hash(name: str = "default") -> str:
+    return registry.weights_hash(name)
+
+_buffers = threading.local()
+
+def _input_buffer(n: int) -> torch.Tensor:
+    """
+    线程内复用的 NHWC float32 输入缓冲（GPU 推理时为锁页内存），不足 n 张时才重新分配。
+    模型输入取它的 NCHW permute 视图（channels_last 布局），不额外拷贝。
+    """
+    buf = getattr(_buffers, "batch", None)
+    if buf is None or buf.shape[0] < n:
+        buf = torch.empty((n, *INPUT_SIZE, 3), dtype=torch.float32, pin_memory=device.type == "cuda")
+        _buffers.batch = buf
+    return buf[:n]
+
+@timed("preprocess")
+def preprocess(image_np: np.ndarray, out: torch.Tensor = None) -> torch.Tensor:
+    """
+    输入: OpenCV 读取的 BGR 图像 (np.ndarray, HWC)
+    输出: 模型输入张量 (torch.Tensor, CHW)，未加 batch 维度，值域 [0, 1]
+    out: 可选的 HWC float32 张量，结果直接写入其中，不分配新内存
+
+    不经过 PIL：cv2.resize 与 BGR→RGB 转换都写入线程内复用的 uint8 缓冲，
+    归一化一步写入目标 float32 缓冲，返回的 CHW 张量是该缓冲的 permute 视图。
+    """
+    if image_np.ndim == 2:
+        image_np = cv2.cvtColor(image_np, cv2.COLOR_GRAY2BGR)
+    elif image_np.shape[2] == 4:
+        image_np = cv2.cvtColor(image_np, cv2.COLOR_BGRA2BGR)
+
+    h, w = INPUT_SIZE
+    resized, rgb = getattr(_buffers, "resized", None), getattr(_buffers, "rgb", None)
+    if resized is None:
+        resized = _buffers.resized = np.empty((h, w, 3), dtype=np.uint8)
+        rgb = _buffers.rgb = np.empty((h, w, 3), dtype=np.uint8)
+
+    if image_np.shape[:2] != (h, w):
+        # 缩小用 INTER_AREA（与 torchvision 抗锯齿缩放接近），放大用双线性
+        shrinking = image_np.shape[0] > h or image_np.shape[1] > w
+        image_np = cv2.resize(image_np, (w, h), dst=resized,
+                              interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+    cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB, dst=rgb)
+
+    if out is None:
+        out = torch.empty((h, w, 3), dtype=torch.float32)
+    np.divide(rgb, np.float32(255.0), out=out.numpy())
+    return out.permute(2, 0, 1)
+
+def _predict_probs(input_tensor: torch.Tensor, model_name: str) -> np.ndarray:
+    model = registry.get(model_name)
+    with stage("forward", model=model_name), torch.no_grad():
+        pred = model(input_tensor.to(device, non_blocking=True))
+        return torch.sigmoid(pred)[:, 0].float().cpu().numpy()  # shape: (N, H, W)
+
+def threshold_mask(prob: np.ndarray, threshold: float = 0.5) -> np.ndarray:
+    """
+    概率图 → 掩膜 (np.ndarray, HW)，值为0或1。与模型推理分离，调整阈值无需重新前向计算。
+    也接受 encode_probability 得到的 uint8 / float16 概率图（uint8 精度为 1/255）。
+    """
+    if prob.dtype == np.uint8:
+        return (prob > threshold * 255.0).astype(np.float32)
+    return (prob > threshold).astype(np.float32)
+
+def encode_probability(prob: np.ndarray, dtype: str = "uint8") -> np.ndarray:
+    """压缩存储概率图：uint8（每像素 1 字节，精度 1/255）或 float16（每像素 2 字节）"""
+    if dtype == "uint8":
+        return np.rint(np.clip(prob, 0.0, 1.0) * 255.0).astype(np.uint8)
+    if dtype == "float16":
+        return prob.astype(np.float16)
+    raise ValueError(f"不支持的概率图存储类型：{dtype}（可选 uint8 / float16）")
+
+def decode_probability(encoded: np.ndarray) -> np.ndarray:
+    """encode_probability 的逆变换，返回 float32 概率图"""
+    if encoded.dtype == np.uint8:
+        return encoded.astype(np.float32) / 255.0
+    return encoded.astype(np.float32)
+
+def run_probability(image_np: np.ndarray, model_name: str = "default") -> np.ndarray:
+    """
+    输入: OpenCV 读取的 BGR 图像 (np.ndarray, HWC)
+    输出: sigmoid 概率图 (np.ndarray, HW, float32)，值域 [0, 1]
+    """
+    buf = _input_buffer(1)
+    preprocess(image_np, out=buf[0])
+    return _predict_probs(buf.permute(0, 3, 1, 2), model_name)[0]
+
+def run_prediction(image_np: np.ndarray, model_name: str = "default", threshold: float = 0.5) -> np.ndarray:
     """
     输入: OpenCV 读取的 RGB 图像 (np.ndarray, HWC)
     输出: 分割掩膜 (np.ndarray, HW)，值为0或1
+    model_name: 使用注册表中的哪个模型（首次使用时加载）
     """
-    pil_img = PILImage.fromarray(cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB)).convert("RGB")
-    input_tensor = transform(pil_img).unsqueeze(0).to(device)
+    return threshold_mask(run_probability(image_np, model_name), threshold)  # 值为 0. 或 1.
 
-    with torch.no_grad():
-        pred = model(input_tensor)
-        pred = torch.sigmoid(pred)
-        pred_mask = (pred > 0.5).float().squeeze().cpu().numpy()  # shape: (H, W)
+def run_prediction_batch(images, batch_size: int = 8, model_name: str = "default", threshold: float = 0.5) -> list:
+    """
+    输入: OpenCV 读取的图像列表 (每个为 np.ndarray, HWC)，尺寸可以不同
+    输出: 分割掩膜列表 (每个为 np.ndarray, HW)，值为0或1，顺序与输入一致
+
+    每 batch_size 张图像直接预处理进复用的输入缓冲，只做一次 UNet 前向计算。
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size 必须为正整数：{batch_size}")
+
+    masks = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        buf = _input_buffer(len(chunk))
+        for i, img in enumerate(chunk):
+            preprocess(img, out=buf[i])
+        masks.extend(threshold_mask(prob, threshold) for prob in _predict_probs(buf.permute(0, 3, 1, 2), model_name))
+
+    return masks  # 每个值为 0. 或 1.
 
-    return pred_mask  # 值为 0. 或 1.
+def run_probability_tensors(tensors, model_name: str = "default") -> list:
+    """
+    输入: 已经过 preprocess 的张量列表 (每个为 torch.Tensor, CHW)
+    输出: 概率图列表 (每个为 np.ndarray, HW, float32)
+
+    所有张量拷入复用的输入缓冲后只做一次前向计算，供预处理与推理分离的流水线使用。
+    """
+    tensors = list(tensors)
+    buf = _input_buffer(len(tensors))
+    for i, tensor in enumerate(tensors):
+        buf[i].copy_(tensor.permute(1, 2, 0))
+    return list(_predict_probs(buf.permute(0, 3, 1, 2), model_name))
+
+def run_prediction_tensors(tensors, model_name: str = "default", threshold: float = 0.5) -> list:
+    """
+    输入: 已经过 preprocess 的张量列表 (每个为 torch.Tensor, CHW)
+    输出: 分割掩膜列表 (每个为 np.ndarray, HW)，值为0或1
+    """
+    return [threshold_mask(prob, threshold) for prob in run_probability_tensors(tensors, model_name)]
+
+def _tile_starts(length: int, tile_size: int, stride: int) -> list:
+    """沿一个轴的切片起点，最后一块贴齐边缘，保证完整覆盖"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] != length - tile_size:
+        starts.append(length - tile_size)
+    return starts
+
+def _blend_window(tile_size: int) -> np.ndarray:
+    """
+    切片融合权重：中心高、边缘低的二维三角窗。
+    边缘保留一个很小的下限，使图像边界处的像素仍有有效权重。
+    """
+    ramp = 1.0 - np.abs(np.linspace(-1.0, 1.0, tile_size, dtype=np.float32))
+    ramp = np.maximum(ramp, 1e-3)
+    return np.outer(ramp, ramp)
+
+def run_probability_tiled(image_np: np.ndarray, tile_size: int = 896, stride: int = 768,
+                          batch_size: int = 4, model_name: str = "default") -> np.ndarray:
+    """
+    原始分辨率下的滑窗切片推理（适用于无人机、线扫等大幅面图像）。
+    输入: OpenCV 读取的 BGR 图像 (np.ndarray, HWC)，任意尺寸
+    输出: 概率图 (np.ndarray, HW, float32)，与输入同尺寸
+
+    相邻切片按 tile_size - stride 像素重叠，重叠区的概率按三角窗加权平均，消除拼缝。
+    模型每次只处理 batch_size 个 tile_size×tile_size 的切片，显存/内存占用与原图尺寸无关。
+    """
+    if tile_size % 16 != 0:
+        raise ValueError(f"tile_size 必须是 16 的倍数（UNet 下采样 4 次）：{tile_size}")
+    if not 0 < stride <= tile_size:
+        raise ValueError(f"stride 必须在 (0, tile_size] 范围内：{stride}")
+
+    model = registry.get(model_name)
+    rgb = cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB)
+    h, w = rgb.shape[:2]
+
+    # 小于切片尺寸的图像镜像填充到 tile_size
+    pad_h, pad_w = max(tile_size - h, 0), max(tile_size - w, 0)
+    if pad_h or pad_w:
+        rgb = cv2.copyMakeBorder(rgb, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
+    ph, pw = rgb.shape[:2]
+
+    window = _blend_window(tile_size)
+    prob_sum = np.zeros((ph, pw), dtype=np.float32)
+    weight_sum = np.zeros((ph, pw), dtype=np.float32)
+
+    coords = [(y, x) for y in _tile_starts(ph, tile_size, stride) for x in _tile_starts(pw, tile_size, stride)]
+    for start in range(0, len(coords), batch_size):
+        chunk = coords[start:start + batch_size]
+        tiles = np.stack([rgb[y:y + tile_size, x:x + tile_size] for y, x in chunk])
+        input_tensor = torch.from_numpy(tiles).permute(0, 3, 1, 2).float().div_(255.0).to(device)
+
+        with stage("forward", model=model_name), torch.no_grad():
+            pred = torch.sigmoid(model(input_tensor))[:, 0].cpu().numpy()  # shape: (N, T, T)
+
+        for (y, x), prob in zip(chunk, pred):
+            prob_sum[y:y + tile_size, x:x + tile_size] += prob * window
+            weight_sum[y:y + tile_size, x:x + tile_size] += window
+
+    return prob_sum[:h, :w] / weight_sum[:h, :w]
+
+def run_prediction_tiled(image_np: np.ndarray, tile_size: int = 896, stride: int = 768,
+                         batch_size: int = 4, model_name: str = "default", threshold: float = 0.5) -> np.ndarray:
+    """
+    切片推理后按 threshold 二值化，输出与输入同尺寸的分割掩膜 (np.ndarray, HW)，值为0或1
+    """
+    prob = run_probability_tiled(image_np, tile_size=tile_size, stride=stride, batch_size=batch_size,
+                                 model_name=model_name)
+    return threshold_mask(prob, threshold)  # 值为 0. 或 1.
@@ -0,0 +1,85 @@
+import os
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from crack_quantification.quantifier import measure_mask, render_width_visualization
+from instrumentation import metrics
+
+
+def _pool_context():
+    # 父进程里已有解码/推理/写盘线程，fork 时若某个线程正持有 metrics._lock 等锁，
+    # 子进程中该锁永远不会释放；改用 forkserver 从干净的服务进程派生工作进程
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return None
+
+
+def _quantify_shared(mask_name, shape, pixel_size_mm, per_crack):
+    """在工作进程中运行：直接读共享内存中的掩膜，只回传结果行和最大宽度线段的两个端点"""
+    # 工作进程与父进程共用同一个 resource_tracker，共享内存由父进程负责 unlink
+    mask_shm = shared_memory.SharedMemory(name=mask_name)
+    try:
+        mask = np.ndarray(shape, dtype=np.uint8, buffer=mask_shm.buf)
+        row, segment = measure_mask(mask, pixel_size_mm, per_crack=per_crack)
+        del mask
+        return row, segment, metrics.snapshot(reset=True)
+    finally:
+        mask_shm.close()
+
+
+class SharedMemoryQuantifier:
+    """
+    多进程量化执行器：掩膜经 multiprocessing.shared_memory 传给工作进程，整幅数组不经过 pickle；
+    工作进程只回传最大宽度线段的端点，宽度可视化图由父进程用自己持有的掩膜绘制。
+    workers 默认为 CPU 核数；submit 返回的 Future 结果与 quantify_mask 相同：(row, width_vis)。
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+
+    def submit(self, mask_uint8, pixel_size_mm, per_crack=False):
+        mask_uint8 = np.ascontiguousarray(mask_uint8, dtype=np.uint8)
+        mask_shm = shared_memory.SharedMemory(create=True, size=max(mask_uint8.nbytes, 1))
+        np.ndarray(mask_uint8.shape, dtype=np.uint8, buffer=mask_shm.buf)[...] = mask_uint8
+
+        result = Future()
+
+        def release():
+            mask_shm.close()
+            mask_shm.unlink()
+
+        def done(inner):
+            try:
+                row, segment, worker_metrics = inner.result()
+                metrics.merge(worker_metrics)
+                result.set_result((row, render_width_visualization(mask_uint8, segment)))
+            except Exception as e:
+                result.set_exception(e)
+            finally:
+                release()
+
+        try:
+            inner = self._pool.submit(_quantify_shared, mask_shm.name, mask_uint8.shape, pixel_size_mm, per_crack)
+        except Exception:
+            release()
+            raise
+        inner.add_done_callback(done)
+        return result
+
+    def map(self, masks, pixel_size_mm, per_crack=False):
+        """按输入顺序返回每张掩膜的 (row, width_vis)"""
+        futures = [self.submit(mask, pixel_size_mm, per_crack=per_crack) for mask in masks]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
@@ -3,71 +3,114 @@ import cv2
 from skimage.morphology import thin
 from scipy.spatial import cKDTree
 from scipy.ndimage import convolve
+from instrumentation import stage, timed
 
 def binarize(image):
     gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
     _, binary = cv2.threshold(gray, 127, 1, cv2.THRESH_BINARY)
     return binary
 
-def extract_skeleton(image):
-    binary = binarize(image)
-    skeleton = thin(binary)
-    return skeleton.astype(np.uint8)  # 0/1
-
-def visualize_max_width(image):
-    binary = binarize(image)
-    skeleton = thin(binary)
-    contours, _ = cv2.findContours((binary * 255).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+class MaskAnalysis:
+    """
+    一张掩膜的共享分析上下文：二值图、骨架、距离变换和骨架邻居数只计算一次，
+    供特征提取、可视化和合规检查复用（thin 是单张图像最耗时的步骤）。
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.binary = binarize(image)
+        with stage("thin"):
+            self.skeleton = thin(self.binary).astype(np.uint8)  # 0/1
+        with stage("distance_transform"):
+            self.dist_transform = cv2.distanceTransform((self.binary * 255).astype(np.uint8), cv2.DIST_L2, 5)
+
+        kernel = np.ones((3, 3), dtype=int)
+        with stage("skeleton_neighbors"):
+            self.neighbors = convolve(self.skeleton, kernel, mode='constant') * self.skeleton
+        self._contours = None
+
+    @property
+    def contours(self):
+        # 轮廓只在可视化时需要，按需计算一次
+        if self._contours is None:
+            self._contours, _ = cv2.findContours((self.binary * 255).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        return self._contours
+
+def analyze_mask(image):
+    return MaskAnalysis(image)
+
+def extract_skeleton(image, analysis=None):
+    analysis = analysis or analyze_mask(image)
+    return analysis.skeleton  # 0/1
+
+@timed("max_width_search")
+def find_max_width(image, analysis=None):
+    """
+    最大宽度线段搜索：返回 (max_dist, pt1, pt2)，pt1/pt2 为线段两端的 (x, y) 整数元组，
+    没有裂缝时为 None。只回传两个端点，多进程量化时由父进程调用 draw_max_width 绘图。
+    """
+    analysis = analysis or analyze_mask(image)
+    skeleton, contours = analysis.skeleton, analysis.contours
     if not contours:
-        return np.zeros_like(image), 0.0
+        return 0.0, None, None
 
     contour_pts = np.vstack([c.reshape(-1, 2) for c in contours])
-    tree = cKDTree(contour_pts)
+    skeleton_pts = np.argwhere(skeleton)[:, ::-1]  # (x, y)，与轮廓点坐标顺序一致
     max_dist, pt1, pt2 = 0, None, None
 
-    for y, x in np.argwhere(skeleton):
-        dists, idxs = tree.query([x, y], k=2)
-        if len(idxs) == 2:
-            p1, p2 = contour_pts[idxs[0]], contour_pts[idxs[1]]
-            dist = np.linalg.norm(p1 - p2)
-            if dist > max_dist:
-                max_dist, pt1, pt2 = dist, p1, p2
-
+    if len(skeleton_pts) > 0 and len(contour_pts) >= 2:
+        # 对所有骨架点做一次批量 k=2 近邻查询，取两近邻轮廓点间距最大者（并列时取第一个，与逐点循环一致）
+        tree = cKDTree(contour_pts)
+        _, idxs = tree.query(skeleton_pts, k=2)
+        p1s, p2s = contour_pts[idxs[:, 0]], contour_pts[idxs[:, 1]]
+        dists = np.linalg.norm(p1s - p2s, axis=1)
+        best = int(np.argmax(dists))
+        if dists[best] > max_dist:
+            max_dist, pt1, pt2 = dists[best], p1s[best], p2s[best]
+
+    if pt1 is None or pt2 is None:
+        return max_dist, None, None
+    return max_dist, tuple(int(v) for v in pt1), tuple(int(v) for v in pt2)
+
+@timed("visualize_max_width")
+def draw_max_width(image, pt1=None, pt2=None, binary=None):
+    """在二值图（BGR）上用红线画出最大宽度线段；掩膜为空时返回与 image 同形状的全零图"""
+    binary = binarize(image) if binary is None else binary
+    if not binary.any():
+        return np.zeros_like(image)
     output = cv2.cvtColor((binary * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
     if pt1 is not None and pt2 is not None:
-        cv2.line(output, tuple(pt1), tuple(pt2), (0, 0, 255), 2)
+        cv2.line(output, pt1, pt2, (0, 0, 255), 2)
+    return output
 
-    return output, max_dist
+def visualize_max_width(image, analysis=None):
+    analysis = analysis or analyze_mask(image)
+    max_dist, pt1, pt2 = find_max_width(image, analysis=analysis)
+    return draw_max_width(image, pt1, pt2, binary=analysis.binary), max_dist
 
-def detect_branches_endpoints(image):
-    binary = binarize(image)
-    skeleton = thin(binary)
-    skel = skeleton.astype(np.uint8)
-
-    kernel = np.ones((3, 3), dtype=int)
-    neighbors = convolve(skel, kernel, mode='constant') * skel
+def detect_branches_endpoints(image, analysis=None):
+    analysis = analysis or analyze_mask(image)
+    skel, neighbors = analysis.skeleton, analysis.neighbors
 
     endpoints = np.logical_and(skel == 1, neighbors == 2)
     branches = np.logical_and(skel == 1, neighbors >= 4)
 
     return int(np.sum(endpoints)), int(np.sum(branches))
 
-def compute_features(image, pixel_size_mm, max_width_th=2.0, avg_width_th=1.0, area_ratio_th=5.0, length_th=200.0):
-    binary = binarize(image)
-    skeleton = thin(binary)
+def compute_features(image, pixel_size_mm, max_width_th=2.0, avg_width_th=1.0, area_ratio_th=5.0, length_th=200.0,
+                     analysis=None, render=True):
+    # render=False 时不绘制 width_visualization（为 None），只在 max_width_segment 中给出线段端点
+    analysis = analysis or analyze_mask(image)
+    binary, skeleton = analysis.binary, analysis.skeleton
 
     area = np.sum(binary)
     length = np.sum(skeleton)
-    dist_transform = cv2.distanceTransform((binary * 255).astype(np.uint8), cv2.DIST_L2, 5)
-    skel_dist = dist_transform[skeleton.astype(bool)]
+    skel_dist = analysis.dist_transform[skeleton.astype(bool)]
 
     avg_width = np.mean(skel_dist) * 2 if skel_dist.size > 0 else 0.0
     max_width = np.max(skel_dist) * 2 if skel_dist.size > 0 else 0.0
 
-    kernel = np.ones((3, 3), dtype=int)
-    neighbors = convolve(skeleton.astype(np.uint8), kernel, mode='constant') * skeleton
-    endpoints = np.logical_and(skeleton == 1, neighbors == 2)
-    branches = np.logical_and(skeleton == 1, neighbors >= 4)
+    num_endpoints, num_branches = detect_branches_endpoints(image, analysis=analysis)
 
     area_mm2 = area * (pixel_size_mm ** 2)
     length_mm = length * pixel_size_mm
@@ -82,7 +125,8 @@ def compute_features(image, pixel_size_mm, max_width_th=2.0, avg_width_th=1.0, a
         "Length OK": length_mm <= length_th,
     }
 
-    vis_img, _ = visualize_max_width(image)
+    _, pt1, pt2 = find_max_width(image, analysis=analysis)
+    vis_img = draw_max_width(image, pt1, pt2, binary=analysis.binary) if render else None
 
     return {
         "Area (mm^2)": round(area_mm2, 2),
@@ -90,28 +134,110 @@ def compute_features(image, pixel_size_mm, max_width_th=2.0, avg_width_th=1.0, a
         "Avg Width (mm)": round(avg_width_mm, 2),
         "Max Width (mm)": round(max_width_mm, 2),
         "Area Ratio (%)": round(area_ratio, 2),
-        "Endpoints": int(np.sum(endpoints)),
-        "Branch Points": int(np.sum(branches)),
-        "Estimated Branches": max(int(np.sum(branches)) - 1, 0),
+        "Endpoints": num_endpoints,
+        "Branch Points": num_branches,
+        "Estimated Branches": max(num_branches - 1, 0),
         "Pixel Size (mm)": pixel_size_mm,
         "Compliance": compliance,
-        "width_visualization": vis_img
+        "width_visualization": vis_img,
+        "max_width_segment": None if pt1 is None else (pt1, pt2),
     }
 
-def compliance_check(image, pixel_size_mm, max_width_th, avg_width_th, area_ratio_th, length_th):
-    binary = binarize(image)
-    total_area = binary.shape[0] * binary.shape[1]
-    features = compute_features(image, pixel_size_mm)
-
-    area_ratio = 100 * (np.sum(binary) / total_area) if total_area > 0 else 0.0
-
-    compliance = {
-        "Max Width OK": features["Max Width (mm)"] <= max_width_th,
-        "Avg Width OK": features["Avg Width (mm)"] <= avg_width_th,
-        "Area Ratio OK": area_ratio <= area_ratio_th,
-        "Length OK": features["Length (mm)"] <= length_th
+def compliance_check(image, pixel_size_mm, max_width_th, avg_width_th, area_ratio_th, length_th, analysis=None):
+    analysis = analysis or analyze_mask(image)
+    return compute_features(image, pixel_size_mm, max_width_th=max_width_th, avg_width_th=avg_width_th,
+                            area_ratio_th=area_ratio_th, length_th=length_th, analysis=analysis)
+
+def label_cracks(binary, connectivity=8):
+    """
+    连通域标记，作为逐条裂缝的区域索引。
+    返回 (labels, stats)：labels 为 int32 标签图（0 为背景），
+    stats[i] = [x, y, w, h, area]，对应 cv2.connectedComponentsWithStats 的输出。
+    """
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(binary.astype(np.uint8), connectivity=connectivity)
+    return labels, stats
+
+@timed("per_crack_features")
+def compute_crack_features(image, pixel_size_mm, max_width_th=2.0, avg_width_th=1.0, length_th=200.0,
+                           connectivity=8, min_area_px=1, analysis=None):
+    """
+    逐条裂缝（连通域）量化，每条裂缝一行：
+    面积、长度、平均/最大宽度、端点、分叉点、外接框以及逐条合规结果。
+    直接复用整图 MaskAnalysis 的骨架、距离变换和骨架邻居数，按每条裂缝的外接框切片，不再重复 thin。
+    """
+    analysis = analysis or analyze_mask(image)
+    labels, stats = label_cracks(analysis.binary, connectivity=connectivity)
+
+    rows = []
+    for label in range(1, len(stats)):
+        x, y, w, h, area = (int(v) for v in stats[label])
+        if area < min_area_px:
+            continue
+
+        # 外接框内可能有其他裂缝的像素，只保留本条裂缝的骨架
+        window = (slice(y, y + h), slice(x, x + w))
+        skeleton = analysis.skeleton[window] * (labels[window] == label)
+        skel_dist = analysis.dist_transform[window][skeleton.astype(bool)]
+        neighbors = analysis.neighbors[window] * skeleton
+
+        length_mm = np.sum(skeleton) * pixel_size_mm
+        avg_width_mm = (np.mean(skel_dist) * 2 if skel_dist.size > 0 else 0.0) * pixel_size_mm
+        max_width_mm = (np.max(skel_dist) * 2 if skel_dist.size > 0 else 0.0) * pixel_size_mm
+
+        rows.append({
+            "Crack ID": label,
+            "Area (mm^2)": round(area * (pixel_size_mm ** 2), 2),
+            "Length (mm)": round(length_mm, 2),
+            "Avg Width (mm)": round(avg_width_mm, 2),
+            "Max Width (mm)": round(max_width_mm, 2),
+            "Endpoints": int(np.sum(np.logical_and(skeleton == 1, neighbors == 2))),
+            "Branch Points": int(np.sum(np.logical_and(skeleton == 1, neighbors >= 4))),
+            "BBox X": x,
+            "BBox Y": y,
+            "BBox W": w,
+            "BBox H": h,
+            "Max Width OK": max_width_mm <= max_width_th,
+            "Avg Width OK": avg_width_mm <= avg_width_th,
+            "Length OK": length_mm <= length_th,
+        })
+
+    return rows
+
+@timed("quantify")
+def measure_mask(mask_uint8, pixel_size_mm, per_crack=False):
+    """
+    quantify_mask 的计算部分，不绘制宽度可视化图（只依赖本模块，可直接提交到进程池）。
+    返回 (row, segment)：segment 为最大宽度线段端点 (pt1, pt2)，没有裂缝时为 None。
+    """
+    analysis = analyze_mask(mask_uint8)
+    features = compute_features(mask_uint8, pixel_size_mm=pixel_size_mm, analysis=analysis, render=False)
+
+    row = {
+        "Max Width (mm)": features["Max Width (mm)"],
+        "Avg Width (mm)": features["Avg Width (mm)"],
+        "Length (mm)": features["Length (mm)"],
+        "Area (mm^2)": features["Area (mm^2)"],
+        "Area Ratio": features["Area Ratio (%)"],
+        "Max Width OK": features["Compliance"]["Max Width OK"],
+        "Avg Width OK": features["Compliance"]["Avg Width OK"],
+        "Area Ratio OK": features["Compliance"]["Area Ratio OK"],
+        "Length OK": features["Compliance"]["Length OK"],
     }
-
-    features["Area Ratio (%)"] = round(area_ratio, 2)
-    features["Compliance"] = compliance
-    return features
+    if per_crack:
+        row["Cracks"] = compute_crack_features(mask_uint8, pixel_size_mm=pixel_size_mm, analysis=analysis)
+
+    return row, features["max_width_segment"]
+
+def render_width_visualization(mask_uint8, segment):
+    """由 measure_mask 返回的线段端点绘制 uint8 宽度可视化图"""
+    pt1, pt2 = segment or (None, None)
+    return draw_max_width(mask_uint8, pt1, pt2)
+
+def quantify_mask(mask_uint8, pixel_size_mm, per_crack=False):
+    """
+    批处理使用的单张掩膜量化入口。
+    返回 (row, width_vis)：row 为结果表的一行（不含 Filename），
+    per_crack=True 时 row["Cracks"] 为逐条裂缝表；width_vis 为 uint8 宽度可视化图。
+    """
+    row, segment = measure_mask(mask_uint8, pixel_size_mm, per_crack=per_crack)
+    return row, render_width_visualization(mask_uint8, segment)
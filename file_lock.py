@@ -0,0 +1,22 @@
+# file_lock.py
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，退化为不加锁
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程互斥锁（flock），界面、批处理和 ingest 进程共用同一份索引或清单时保护其读-改-写"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,216 @@
+# ingest.py
+# 流式入库：持续监视目录，新图像写完后立即送入 解码 → 推理 → 量化 → 写盘 流水线，
+# 每张图像完成即追加进 results_store，单张图像从落盘到入库的延迟为秒级，不必反复重跑批处理。
+# 用法：python ingest.py [--watch-dir input_images] [--poll 0.5] [--settle 1.0] [--pixel-size 0.1]
+#        [--threshold 0.5] [--batch-size 8] [--per-crack] [--tiled]
+# Ctrl+C / SIGTERM 停止监视，已进入流水线的图像处理完后退出。
+
+import os
+import time
+import signal
+import argparse
+import threading
+
+from agent_main import run_params
+from pipeline import run_pipeline
+from mask_store import mask_store
+from results_store import results_store
+from manifest import load_manifest, update_manifest, make_entry, is_up_to_date
+from instrumentation import metrics, log_event, write_metrics_file
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+FLUSH_INTERVAL_S = 5.0  # 运行期间写回清单、掩膜索引和 output/metrics.prom 的间隔
+
+
+class DirectoryWatcher:
+    """
+    以轮询方式监视目录（不依赖 inotify，网络盘和容器挂载目录同样可用），迭代产出可以处理的图像路径。
+    文件的大小和修改时间在两次轮询之间不变、且距最后一次写入已超过 settle_s 秒才视为写完，
+    避免读到相机或拷贝程序写了一半的文件；已产出的文件被改写后会再次产出。
+    skip(path) 返回 True 的文件不产出（例如清单中已是最新）。
+    迭代由下游按需拉取：流水线队列满时不会继续扫描，新文件留在磁盘上等待，内存占用有上限。
+    """
+
+    def __init__(self, directory, poll_interval=0.5, settle_s=1.0, skip=None):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.settle_s = settle_s
+        self.skip = skip
+        self._seen = {}      # 文件名 -> 上次轮询时的 (size, mtime_ns)
+        self._emitted = {}   # 文件名 -> 产出时的 (size, mtime_ns)
+        self._stop = threading.Event()
+
+    def poll(self):
+        """扫描一次目录，返回本次确认写完的新文件（按修改时间排序）"""
+        now = time.time()
+        ready, present = [], set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # 扫描期间被删除或改名
+                    continue
+                present.add(entry.name)
+                signature = (stat.st_size, stat.st_mtime_ns)
+                previous, self._seen[entry.name] = self._seen.get(entry.name), signature
+                if (self._emitted.get(entry.name) == signature or previous != signature
+                        or stat.st_size == 0 or now - stat.st_mtime < self.settle_s):
+                    continue
+                self._emitted[entry.name] = signature
+                if self.skip is None or not self.skip(entry.path):
+                    ready.append((stat.st_mtime, entry.path))
+
+        # 已删除的文件不再跟踪
+        for name in set(self._seen) - present:
+            self._seen.pop(name, None)
+            self._emitted.pop(name, None)
+        return [path for _, path in sorted(ready)]
+
+    def __iter__(self):
+        while not self._stop.is_set():
+            yield from self.poll()
+            self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+def ingest(watch_dir="input_images", pixel_size_mm=0.1, poll_interval=0.5, settle_s=1.0, batch_size=8,
+           tiled=False, tile_size=896, stride=768, per_crack=False, use_cache=True, decode_workers=2,
+           quant_workers=None, queue_size=16, model_name="default", threshold=0.5, save_probability=False,
+           prob_dtype="uint8", watcher=None):
+    """
+    长时间运行的入库模式：监视 watch_dir，新图像（或被改写的图像）写完后即进入 run_pipeline 流式处理，
+    每张完成后立即追加进 results_store 的同一次运行；清单（与 agent_main.main 共用，启动时清单中
+    已是最新的文件直接跳过）和掩膜索引每 FLUSH_INTERVAL_S 秒合并写回一次，而不是每张图像都重写整个文件。
+    单张端到端延迟（文件最后写入 → 入库）记为 crack_ingest_seconds 直方图。
+    阻塞运行，直到 watcher.stop()；退出时结束本次运行、导出 CSV 并写出指标，返回 run_id。
+    """
+    params = run_params(pixel_size_mm, tiled, tile_size, stride, per_crack, model_name, threshold)
+    manifest = load_manifest()
+    done = results_store.filenames()
+
+    state_lock = threading.Lock()
+    changes = {}  # 上次写回之后本进程改动的清单条目
+
+    def skip(path):
+        fname = os.path.basename(path)
+        with state_lock:
+            entry = manifest.get(fname)
+            mtime = entry and entry.get("mtime")
+        if not (fname in done and is_up_to_date(entry, path, params)):
+            return False
+        if entry["mtime"] != mtime:  # 内容未变只是被 touch 过，刷新后的条目也要写回
+            with state_lock:
+                changes[fname] = entry
+        return True
+
+    watcher = watcher or DirectoryWatcher(watch_dir, poll_interval=poll_interval, settle_s=settle_s)
+    watcher.skip = skip
+    pending = {}  # 文件名 -> (清单条目, 文件落盘时间)，在送入流水线前记录
+
+    def paths():
+        for path in watcher:
+            try:
+                entry = make_entry(path, params)
+            except OSError as e:  # 确认写完后又被删除
+                print(f"⚠️ 跳过 {os.path.basename(path)}：{e}")
+                continue
+            pending[os.path.basename(path)] = (entry, entry["mtime"])
+            yield path
+
+    def persist():
+        """把本进程的清单改动合并写回，并写回掩膜索引和指标文件（没有改动时不重写清单和索引）"""
+        nonlocal changes
+        with state_lock:
+            changed, changes = changes, {}
+        if changed:
+            try:
+                merged = update_manifest(changed)
+            except Exception:
+                # 写入失败时把改动放回，下次写回再试
+                with state_lock:
+                    changes = {**changed, **changes}
+                raise
+            with state_lock:
+                # 合并结果含其他进程写入的条目；合并期间本进程的新改动以内存中的为准
+                manifest.clear()
+                manifest.update(merged)
+                manifest.update(changes)
+            mask_store.flush()
+        write_metrics_file()
+
+    stop_flush = threading.Event()
+
+    def flush_loop():
+        while not stop_flush.wait(FLUSH_INTERVAL_S):
+            try:
+                persist()
+            except Exception as e:
+                print(f"⚠️ 写回清单/掩膜索引失败：{e}")
+
+    run_id = results_store.start_run(params)
+    log_event("ingest_started", run_id=run_id, watch_dir=watch_dir, **params)
+    print(f"👀 开始监视 {watch_dir}（运行 {run_id}），新图像写完后自动处理入库")
+    flusher = threading.Thread(target=flush_loop, name="ingest-flush", daemon=True)
+    flusher.start()
+
+    def on_result(result):
+        fname = result["Filename"]
+        results_store.add_results(run_id, [result])
+        entry, landed = pending.pop(fname, (None, None))
+        with state_lock:
+            if entry is not None:
+                manifest[fname] = changes[fname] = entry
+            done.add(fname)
+
+        if landed is not None:
+            latency = time.time() - landed
+            metrics.observe_latency("ingest", latency)
+            log_event("ingested", run_id=run_id, filename=fname, latency_s=round(latency, 3))
+            print(f"📥 {fname} 已入库，端到端延迟 {latency:.2f}s")
+
+    try:
+        run_pipeline(paths(), pixel_size_mm=pixel_size_mm, batch_size=batch_size, tiled=tiled,
+                     tile_size=tile_size, stride=stride, per_crack=per_crack, use_cache=use_cache,
+                     decode_workers=decode_workers, quant_workers=quant_workers, queue_size=queue_size,
+                     model_name=model_name, threshold=threshold, save_probability=save_probability,
+                     prob_dtype=prob_dtype, on_result=on_result, streaming=True)
+    finally:
+        stop_flush.set()
+        flusher.join()
+        results_store.finish_run(run_id)
+        persist()
+        metrics_path = "output/result_metrics.csv"
+        results_store.export_csv(metrics_path)
+        if per_crack:
+            results_store.export_csv("output/result_cracks.csv", cracks=True)
+        log_event("ingest_finished", run_id=run_id)
+        print(f"✅ 停止监视，本次入库结果已保存到 {results_store.path}，并导出到 {metrics_path}")
+    return run_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监视目录，新图像写完后自动分割、量化并入库")
+    parser.add_argument("--watch-dir", default="input_images")
+    parser.add_argument("--poll", type=float, default=0.5, help="轮询间隔（秒）")
+    parser.add_argument("--settle", type=float, default=1.0, help="文件多久未被写入才视为写完（秒）")
+    parser.add_argument("--pixel-size", type=float, default=0.1)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--tiled", action="store_true")
+    parser.add_argument("--per-crack", action="store_true")
+    parser.add_argument("--model", default="default", help="predict.registry 中的模型名")
+    args = parser.parse_args()
+
+    watcher = DirectoryWatcher(args.watch_dir, poll_interval=args.poll, settle_s=args.settle)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: watcher.stop())
+    ingest(args.watch_dir, pixel_size_mm=args.pixel_size, batch_size=args.batch_size, tiled=args.tiled,
+           per_crack=args.per_crack, model_name=args.model, threshold=args.threshold, watcher=watcher)
+
+
+if __name__ == "__main__":
+    main()
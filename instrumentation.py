@@ -0,0 +1,267 @@
+# instrumentation.py
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+METRICS_PATH = "output/metrics.prom"
+PROFILE_DIR = "output/profiles"
+# 阶段耗时直方图的桶边界（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("crack")
+
+
+class Metrics:
+    """
+    进程内指标表：耗时直方图（count / sum / 各桶计数）和计数器，按 (指标名, 标签) 区分。
+    流水线各阶段的耗时都记在 crack_stage_seconds（以 stage 标签区分），
+    端到端延迟等其他耗时用 observe_latency 记为独立的 crack_<name>_seconds 直方图。
+    线程安全；工作进程中的记录可用 snapshot(reset=True) 取出，在父进程 merge 汇总。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}   # (metric, labels) -> [count, sum, bucket_counts]
+        self._counters = {}  # (name, labels) -> value
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def _observe(self, key, seconds):
+        with self._lock:
+            entry = self._timings.setdefault(key, [0, 0.0, [0] * len(BUCKETS)])
+            entry[0] += 1
+            entry[1] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry[2][i] += 1
+
+    def observe(self, stage, seconds, **labels):
+        """记录一次流水线阶段耗时（crack_stage_seconds{stage=...}）"""
+        self._observe(self._key("stage", {"stage": stage, **labels}), seconds)
+
+    def observe_latency(self, name, seconds, **labels):
+        """记录阶段以外的耗时，例如 ingest 的端到端延迟（crack_<name>_seconds）"""
+        self._observe(self._key(name, labels), seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            snap = {
+                "timings": [[metric, list(labels), count, total, list(buckets)]
+                            for (metric, labels), (count, total, buckets) in self._timings.items()],
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+            }
+            if reset:
+                self._timings.clear()
+                self._counters.clear()
+        return snap
+
+    def merge(self, snap):
+        with self._lock:
+            for metric, labels, count, total, buckets in snap["timings"]:
+                key = (metric, tuple(tuple(item) for item in labels))
+                entry = self._timings.setdefault(key, [0, 0.0, [0] * len(BUCKETS)])
+                entry[0] += count
+                entry[1] += total
+                entry[2] = [a + b for a, b in zip(entry[2], buckets)]
+            for name, labels, value in snap["counters"]:
+                key = (name, tuple(tuple(item) for item in labels))
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式：crack_<metric>_seconds（直方图）与 crack_<name>_total（计数器），每个指标只声明一次 TYPE"""
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+        with self._lock:
+            timings = sorted(self._timings.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        declared = None
+        for (metric, labels), (count, total, buckets) in timings:
+            name = f"crack_{metric}_seconds"
+            if name != declared:
+                help_text = "Time spent in each pipeline stage" if metric == "stage" else f"{metric} latency"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                declared = name
+            for bound, n in zip(BUCKETS, buckets):
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {n}")
+            lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {count}")
+        for (metric, labels), value in counters:
+            name = f"crack_{metric}_total"
+            if name != declared:
+                lines += [f"# HELP {name} Number of {metric.replace('_', ' ')}", f"# TYPE {name} counter"]
+                declared = name
+            lines.append(f"{name}{fmt_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """{stage: {"count", "total_s", "mean_ms"}}，便于打印或写日志"""
+        with self._lock:
+            items = list(self._timings.items())
+        summary = {}
+        for (metric, labels), (count, total, _) in items:
+            labels = dict(labels)
+            name = labels.pop("stage") if metric == "stage" else metric
+            name += "".join(f"[{k}={v}]" for k, v in labels.items())
+            summary[name] = {"count": count, "total_s": round(total, 4),
+                             "mean_ms": round(total / count * 1000, 3) if count else 0.0}
+        return summary
+
+
+metrics = Metrics()
+
+
+def log_event(event, **fields):
+    """结构化日志：一行 JSON，写入 "crack" logger（默认不输出，见 configure_logging）"""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": event, "ts": round(time.time(), 3), **fields},
+                               ensure_ascii=False, default=str))
+
+
+def configure_logging(path=None, level=None):
+    """把结构化日志输出到文件（或标准错误）；level 默认取环境变量 CRACK_LOG_LEVEL，未设置时为 INFO"""
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level or os.getenv("CRACK_LOG_LEVEL", "INFO"))
+    return handler
+
+
+@contextmanager
+def stage(name, **labels):
+    """记录一个阶段的耗时（直方图 + 结构化日志）；阶段内抛出异常时另计 errors 计数器"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.inc("errors", stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe(name, elapsed, **labels)
+        log_event("stage", stage=name, seconds=round(elapsed, 6), **labels)
+
+
+def timed(name=None, **labels):
+    """函数装饰器版本的 stage，默认以函数名为阶段名"""
+    def decorator(fn):
+        stage_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def maybe_profile(name, sample_rate=None):
+    """
+    按采样率对一次请求做性能剖析，结果写到 output/profiles：
+    采样率取 sample_rate 或环境变量 CRACK_PROFILE_SAMPLE（默认 0，即关闭）；
+    CRACK_PROFILER=pyinstrument 且已安装 pyinstrument 时输出 HTML，否则用 cProfile 输出 .prof。
+    """
+    rate = float(os.getenv("CRACK_PROFILE_SAMPLE", "0")) if sample_rate is None else sample_rate
+    if rate <= 0 or random.random() >= rate:
+        yield
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if os.getenv("CRACK_PROFILER") == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+        if Profiler is not None:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path = os.path.join(PROFILE_DIR, f"{name}-{stamp}.html")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+                log_event("profile", name=name, path=path)
+            return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # 同一线程中已有剖析器在运行
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(PROFILE_DIR, f"{name}-{stamp}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        log_event("profile", name=name, path=path)
+
+
+def write_metrics_file(path=METRICS_PATH):
+    """把当前指标以 Prometheus 文本格式原子写入文件（可配合 node_exporter 的 textfile collector）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(metrics.render_prometheus())
+    os.replace(tmp_path, path)
+    return path
+
+
+def start_metrics_server(port=9108, host="0.0.0.0"):
+    """在后台线程启动 /metrics HTTP 端点，返回 server（调用 server.shutdown() 停止）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+def profiled(name=None, sample_rate=None):
+    """函数装饰器版本的 maybe_profile"""
+    def decorator(fn):
+        profile_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with maybe_profile(profile_name, sample_rate=sample_rate):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
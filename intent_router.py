@@ -0,0 +1,116 @@
+import re
+
+# Deterministic fast path for routine commands. route_intent returns the same structure as
+# agent_parser.parse_user_intent, or None when the request is not clearly one of the known
+# patterns, in which case the caller falls back to the LLM parser.
+
+IMAGE_EXTENSIONS = r"(?:jpg|jpeg|png)"
+PATH_RE = re.compile(rf"(input_images[\\/][\w\-.]+\.{IMAGE_EXTENSIONS})\b", re.IGNORECASE)
+FILENAME_RE = re.compile(rf"(?<![\w\-./\\])([\w\-]+\.{IMAGE_EXTENSIONS})\b", re.IGNORECASE)
+PIXEL_SIZE_RE = re.compile(r"(\d+(?:\.\d+)?|\.\d+)\s*(?:mm|millimet(?:er|re)s?)\b", re.IGNORECASE)
+ORDINAL_RE = re.compile(r"\b(first|second|third|fourth|fifth|last)\s+(?:image|picture|photo|one)\b")
+INDEX_RE = re.compile(r"\b(?:image|picture|photo)\s*(?:no\.?|number|#)?\s*(\d+)\b")
+
+ORDINALS = {"first": 0, "second": 1, "third": 2, "fourth": 3, "fifth": 4}
+SINGLE_VERBS = ("visualize", "visualise", "display", "segment", "show", "process", "analyze", "analyse",
+                "detect", "see", "view", "predict")
+ALL_WORDS = ("all images", "all the images", "all pictures", "every image", "each image", "whole folder",
+             "entire folder")
+SUMMARY_WORDS = ("summarize", "summarise", "summary", "report", "overview", "result file")
+METRIC_QUERIES = (
+    ("max width", "max width"), ("maximum width", "max width"), ("avg width", "avg width"),
+    ("average width", "avg width"), ("area", "area"), ("length", "length"), ("how long", "length"),
+    ("compliant", "compliance"), ("compliance", "compliance"),
+)
+ADVICE_WORDS = ("advice", "repair", "fix", "recommend", "suggestion", "how should", "what should")
+# "repair"/"fix" only ask for advice when they refer to the crack itself, not e.g. to a script
+ADVICE_REQUESTS = ("advice", "recommend", "suggest", "how should", "what should")
+REPAIR_RE = re.compile(r"\b(?:repair|fix)\w*\b.*\b(?:crack|cracks|it|this)\b")
+# Negated requests ("do not analyze ...") are never routed locally
+NEGATION_RE = re.compile(r"\b(?:not|don'?t|doesn'?t|never|without|skip|stop|cancel)\b|n't\b")
+# Questions across several images cannot be answered from the last analyzed image
+AGGREGATE_RE = re.compile(r"\b(?:which|how many|images|pictures|photos|every|each|all)\b")
+
+
+def _contains(text: str, words) -> bool:
+    return any(re.search(rf"\b{re.escape(word)}", text) for word in words)
+
+
+def _image_reference(text: str, original: str):
+    """Return image parameters for an explicit path, bare filename, ordinal or 'image N' reference."""
+    match = PATH_RE.search(original)
+    if match:
+        return {"image_path": match.group(1).replace("\\", "/")}
+    match = FILENAME_RE.search(original)
+    if match:
+        return {"image_path": f"input_images/{match.group(1)}"}
+    match = ORDINAL_RE.search(text)
+    if match:
+        word = match.group(1)
+        return {"image_path": "auto_last"} if word == "last" else {"image_index": ORDINALS[word]}
+    match = INDEX_RE.search(text)
+    if match:
+        index = int(match.group(1))
+        return {"image_index": index - 1} if index >= 1 else None
+    return None
+
+
+def route_intent(user_input: str):
+    """
+    Resolve common requests locally:
+      - analyze_one_image for a path, filename, ordinal ("second image") or "image 3" with an analysis verb
+      - analyze_all_images for "all images" style requests
+      - summarize_results for summary/report requests
+      - tool "none" for metric follow-ups and repair advice about the last analyzed image
+    Pixel sizes like "0.25mm" are extracted for the analysis tools.
+    Returns None when the request is ambiguous, negated or matches nothing.
+    """
+    original = user_input.strip()
+    text = original.lower()
+    if not text or NEGATION_RE.search(text):
+        return None
+
+    image = _image_reference(text, original)
+    wants_all = _contains(text, ALL_WORDS)
+    wants_summary = _contains(text, SUMMARY_WORDS)
+    pixel_sizes = PIXEL_SIZE_RE.findall(text)
+    if len(pixel_sizes) > 1:
+        return None
+    pixel_size = float(pixel_sizes[0]) if pixel_sizes else None
+
+    # Conflicting scopes (a specific image and all images / a summary) are left to the LLM
+    if image is not None and (wants_all or wants_summary):
+        return None
+    # Advice or repair requests that also name an image or the whole folder are left to the LLM
+    wants_advice = _contains(text, ADVICE_WORDS)
+    if wants_advice and (image is not None or wants_all):
+        return None
+
+    if image is not None:
+        if not _contains(text, SINGLE_VERBS) and not PATH_RE.search(original) and not FILENAME_RE.search(original):
+            return None
+        params = dict(image)
+        if pixel_size is not None:
+            params["pixel_size"] = pixel_size
+        return {"tool": "analyze_one_image", "parameters": params}
+
+    if wants_summary and not wants_all:
+        if pixel_size is not None:
+            return None
+        return {"tool": "summarize_results", "parameters": {}}
+
+    if wants_all:
+        if wants_summary or not _contains(text, SINGLE_VERBS):
+            return None
+        params = {"pixel_size": pixel_size} if pixel_size is not None else {}
+        return {"tool": "analyze_all_images", "parameters": params}
+
+    # Follow-ups about the most recently analyzed single image; aggregate questions go to the LLM
+    if pixel_size is None and not AGGREGATE_RE.search(text):
+        if _contains(text, ADVICE_REQUESTS) or REPAIR_RE.search(text):
+            return {"tool": "none", "parameters": {"query": "repair advice"}}
+        for phrase, query in METRIC_QUERIES:
+            if re.search(rf"\b{re.escape(phrase)}\b", text):
+                return {"tool": "none", "parameters": {"query": query}}
+
+    return None
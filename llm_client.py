@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import weakref
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_DB = "output/llm_cache.db"
+DEFAULT_MODEL = os.getenv("CRACK_LLM_MODEL", "gpt-4")
+MAX_CACHE_ENTRIES = 10000               # beyond this the oldest responses are evicted
+MAX_CACHE_AGE_S = 30 * 24 * 3600        # responses older than this are ignored and evicted
+EVICT_TO_FRACTION = 0.9                 # evict down to this fraction so the next puts don't evict again
+
+
+class OpenAIBackend:
+    """
+    Chat completions through the OpenAI SDK. base_url may point at any OpenAI-compatible
+    server (a local stand-in model, a stub server), e.g. CRACK_LLM_BASE_URL=http://localhost:8000/v1.
+    The SDK client is created on first use, so importing the agent needs no API key.
+    """
+
+    def __init__(self, api_key=None, base_url=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()  # AsyncOpenAI is bound to one event loop
+        self._lock = threading.Lock()
+
+    def _kwargs(self):
+        return {"api_key": self.api_key or os.getenv("OPENAI_API_KEY"),
+                "base_url": self.base_url or os.getenv("CRACK_LLM_BASE_URL") or None}
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI(**self._kwargs())
+        return self._client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                from openai import AsyncOpenAI
+                client = self._async_clients[loop] = AsyncOpenAI(**self._kwargs())
+        return client
+
+    def complete(self, messages, model, **params) -> str:
+        completion = self.client.chat.completions.create(model=model, messages=messages, **params)
+        return completion.choices[0].message.content
+
+    async def acomplete(self, messages, model, **params) -> str:
+        completion = await self.async_client.chat.completions.create(model=model, messages=messages, **params)
+        return completion.choices[0].message.content
+
+    async def astream(self, messages, model, **params):
+        stream = await self.async_client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                                  **params)
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+
+class StubBackend:
+    """
+    Offline stand-in with no network access, for benchmarks and local development.
+    `responder(messages, model, **params) -> str` may be supplied; by default, prompts asking for
+    JSON get an empty tool call and everything else gets a short placeholder reply.
+    """
+
+    def __init__(self, responder=None):
+        self.responder = responder
+
+    def complete(self, messages, model, **params) -> str:
+        if self.responder is not None:
+            return self.responder(messages, model, **params)
+        prompt = messages[-1]["content"] if messages else ""
+        if "JSON" in prompt:
+            return json.dumps({"tool": "none", "parameters": {}})
+        return f"[stub:{model}] {prompt.strip().splitlines()[0][:200] if prompt.strip() else ''}"
+
+    async def acomplete(self, messages, model, **params) -> str:
+        return self.complete(messages, model, **params)
+
+    async def astream(self, messages, model, **params):
+        for word in self.complete(messages, model, **params).split(" "):
+            yield word + " "
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "stub": StubBackend,
+}
+
+
+class ResponseCache:
+    """
+    Persistent response cache (SQLite), keyed on backend, model, messages and sampling params.
+    Bounded by entry count (oldest first) and by age, so prompts that embed changing data
+    (digests, results) don't grow the file forever.
+    """
+
+    def __init__(self, path=LLM_CACHE_DB, max_entries=MAX_CACHE_ENTRIES, max_age_s=MAX_CACHE_AGE_S):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_s = max_age_s
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS responses "
+                         "(key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(backend, model, messages, params) -> str:
+        payload = json.dumps({"backend": backend, "model": model, "messages": messages, "params": params},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        row = self._connect().execute("SELECT response FROM responses WHERE key = ? AND created_at >= ?",
+                                      (key, time.time() - self.max_age_s)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, model, response):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, model, response, now))
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_s,))
+            count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - int(self.max_entries * EVICT_TO_FRACTION)
+                conn.execute("DELETE FROM responses WHERE key IN "
+                             "(SELECT key FROM responses ORDER BY created_at, rowid LIMIT ?)", (excess,))
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM responses")
+
+
+class LLMClient:
+    """
+    Shared LLM entry point for the parser, executor and tools.
+    Deterministic calls (temperature=0) are served from the persistent cache when the same
+    model, messages and params were seen before; pass cache=True/False to override.
+    validate(response) -> bool, when given, keeps rejected replies (e.g. unparseable JSON)
+    out of the cache and ignores cached replies it rejects, so a bad reply is not replayed.
+    """
+
+    def __init__(self, backend="openai", cache_path=LLM_CACHE_DB, **backend_kwargs):
+        self.backend_name = backend
+        self.backend = BACKENDS[backend](**backend_kwargs)
+        self.cache = ResponseCache(cache_path) if cache_path else None
+        self.hits = 0
+        self.misses = 0
+
+    def chat(self, messages, model=DEFAULT_MODEL, temperature=0, cache=None, validate=None, **params) -> str:
+        params, key = self._cache_key(messages, model, temperature, cache, params)
+        if key is not None:
+            cached = self.cache.get(key)
+            if self._usable(cached, validate):
+                self.hits += 1
+                return cached
+        self.misses += 1
+        response = self.backend.complete(messages, model, **params)
+        if key is not None and self._usable(response, validate):
+            self.cache.put(key, model, response)
+        return response
+
+    @staticmethod
+    def _usable(response, validate):
+        return response is not None and (validate is None or validate(response))
+
+    def _cache_key(self, messages, model, temperature, cache, params):
+        params = {"temperature": temperature, **params}
+        use_cache = self.cache is not None and (temperature == 0 if cache is None else cache)
+        return params, (ResponseCache.make_key(self.backend_name, model, messages, params) if use_cache else None)
+
+    async def achat(self, messages, model=DEFAULT_MODEL, temperature=0, cache=None, validate=None,
+                    **params) -> str:
+        """
+        Async chat() for the asyncio agent core; shares the same response cache.
+        Cache reads and writes are blocking SQLite calls, so they run in a worker thread.
+        """
+        params, key = self._cache_key(messages, model, temperature, cache, params)
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if self._usable(cached, validate):
+                self.hits += 1
+                return cached
+        self.misses += 1
+        response = await self.backend.acomplete(messages, model, **params)
+        if key is not None and self._usable(response, validate):
+            await asyncio.to_thread(self.cache.put, key, model, response)
+        return response
+
+    async def astream(self, messages, model=DEFAULT_MODEL, temperature=0, cache=None, validate=None, **params):
+        """Yield the reply in chunks as the backend produces them; cache hits arrive as one chunk"""
+        params, key = self._cache_key(messages, model, temperature, cache, params)
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if self._usable(cached, validate):
+                self.hits += 1
+                yield cached
+                return
+        self.misses += 1
+        parts = []
+        async for delta in self.backend.astream(messages, model, **params):
+            parts.append(delta)
+            yield delta
+        response = "".join(parts)
+        if key is not None and self._usable(response, validate):
+            await asyncio.to_thread(self.cache.put, key, model, response)
+
+
+# Shared client; CRACK_LLM_BACKEND=stub runs the whole agent offline
+llm = LLMClient(backend=os.getenv("CRACK_LLM_BACKEND", "openai"),
+                cache_path=None if os.getenv("CRACK_LLM_CACHE", "1") == "0" else LLM_CACHE_DB)
+
+
+def chat(messages, model=DEFAULT_MODEL, temperature=0, cache=None, validate=None, **params) -> str:
+    return llm.chat(messages, model=model, temperature=temperature, cache=cache, validate=validate, **params)
+
+
+async def achat(messages, model=DEFAULT_MODEL, temperature=0, cache=None, validate=None, **params) -> str:
+    return await llm.achat(messages, model=model, temperature=temperature, cache=cache, validate=validate,
+                           **params)
+
+
+def astream(messages, model=DEFAULT_MODEL, temperature=0, cache=None, validate=None, **params):
+    return llm.astream(messages, model=model, temperature=temperature, cache=cache, validate=validate, **params)
@@ -0,0 +1,73 @@
+# manifest.py
+
+import os
+import json
+import hashlib
+import threading
+
+from file_lock import file_lock
+
+MANIFEST_PATH = "output/manifest.json"
+
+
+def load_manifest(path=MANIFEST_PATH) -> dict:
+    """读取已处理文件清单 {filename: {"mtime", "size", "sha256", "params"}}，不存在或损坏时返回空清单"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"⚠️ 清单文件损坏，将全部重新处理：{path}")
+        return {}
+
+
+def save_manifest(manifest: dict, path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def update_manifest(changes: dict, path=MANIFEST_PATH, replace=False) -> dict:
+    """
+    在文件锁内重新读取磁盘上的清单，只合并本进程改动的条目后原子写回，返回合并后的清单，
+    批处理、ingest 等多个进程同时写清单时互不覆盖；replace=True 时丢弃磁盘上已有的条目。
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with file_lock(f"{path}.lock"):
+        manifest = {} if replace else load_manifest(path)
+        manifest.update(changes)
+        save_manifest(manifest, path)
+    return manifest
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_entry(path, params: dict) -> dict:
+    stat = os.stat(path)
+    return {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": file_sha256(path), "params": params}
+
+
+def is_up_to_date(entry, path, params: dict) -> bool:
+    """
+    判断文件自上次处理后是否未变：参数必须一致；mtime 和 size 都没变时直接视为未变，
+    否则再比较内容哈希（例如文件只是被 touch 或重新拷贝过）。
+    内容未变但 mtime 变化时会顺带刷新 entry 中的 mtime，下次无需再算哈希。
+    """
+    if not entry or entry.get("params") != params:
+        return False
+    stat = os.stat(path)
+    if entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+        return True
+    if entry.get("size") != stat.st_size or entry.get("sha256") != file_sha256(path):
+        return False
+    entry["mtime"] = stat.st_mtime
+    return True
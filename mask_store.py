@@ -0,0 +1,184 @@
+# mask_store.py
+
+import os
+import json
+import threading
+
+import cv2
+import numpy as np
+
+from file_lock import file_lock
+
+MASK_DIR = "output/masks"
+INDEX_NAME = "index.json"
+LOCK_NAME = "index.lock"
+PNG_DIR = "output/result_images"
+
+
+class MaskStore:
+    """
+    二值掩膜存储：每张掩膜存为一个 .npy 文件，按 Filename 建索引（index.json 记录文件名与尺寸）。
+    packed=True 时按位压缩（np.packbits，每像素 1 bit，体积为 uint8 数组的 1/8），
+    读取时内存映射后按位展开；packed=False 时存原始 uint8 数组，读取直接返回只读内存映射，无需解码。
+    PNG 只在需要时通过 export_png 导出。
+    多个进程可共用同一目录：flush 在文件锁内重新读取磁盘上的索引，只合并本进程新增/删除的条目。
+    """
+
+    def __init__(self, root=MASK_DIR, packed=True):
+        self.root = root
+        self.packed = packed
+        self._index = None
+        self._dirty = {}        # 上次 flush 之后本进程写入的条目
+        self._deleted = set()   # 上次 flush 之后本进程删除的条目
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, INDEX_NAME)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"⚠️ 掩膜索引损坏，将重新建立：{self.index_path}")
+            return {}
+
+    def _entries(self):
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def flush(self):
+        """把本进程的改动合并进磁盘上的索引并原子写回（其他进程写入的条目得以保留）"""
+        os.makedirs(self.root, exist_ok=True)
+        with file_lock(os.path.join(self.root, LOCK_NAME)):
+            with self._lock:
+                dirty, deleted = self._dirty, self._deleted
+                self._dirty, self._deleted = {}, set()
+            try:
+                index = self._load_index()
+                for name in deleted:
+                    index.pop(name, None)
+                index.update(dirty)
+                tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(index, f, ensure_ascii=False, sort_keys=True)
+                os.replace(tmp_path, self.index_path)
+            except Exception:
+                # 写入失败时把改动放回，下次 flush 再试
+                with self._lock:
+                    self._dirty = {**dirty, **self._dirty}
+                    self._deleted |= deleted - set(self._dirty)
+                raise
+
+        with self._lock:
+            # 合并期间本进程又有新改动的，以内存中的为准
+            for name in self._deleted:
+                index.pop(name, None)
+            index.update(self._dirty)
+            self._index = index
+
+    def names(self):
+        with self._lock:
+            return sorted(self._entries())
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries()
+
+    def put(self, name, mask, flush=True, source=None):
+        """
+        保存掩膜（任意非零值视为裂缝），name 为图像文件名。
+        批量写入时可传 flush=False，最后统一调用 flush() 写索引。
+        source 记录掩膜的来源（如结果缓存键），之后可用 source(name) 判断已保存的是否就是同一份结果。
+        """
+        binary = np.asarray(mask) > 0
+        height, width = binary.shape[:2]
+        data = np.packbits(binary, axis=1) if self.packed else binary.astype(np.uint8) * 255
+
+        os.makedirs(self.root, exist_ok=True)
+        file_name = f"{name}.npy"  # 用完整文件名，a.jpg 与 a.png 不会共用同一个掩膜文件
+        path = os.path.join(self.root, file_name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp_path, path)
+
+        entry = {"file": file_name, "shape": [height, width], "packed": self.packed, "source": source}
+        with self._lock:
+            self._entries()[name] = self._dirty[name] = entry
+            self._deleted.discard(name)
+        if flush:
+            self.flush()
+        return path
+
+    def _entry(self, name):
+        with self._lock:
+            entry = self._entries().get(name)
+            if entry is None:
+                # 其他进程可能已写入新掩膜，重新读一次索引
+                self._index = {**self._load_index(), **self._entries()}
+                entry = self._index.get(name)
+        return entry
+
+    def source(self, name):
+        """返回掩膜保存时记录的来源，不存在或未记录时返回 None"""
+        entry = self._entry(name)
+        return None if entry is None else entry.get("source")
+
+    def get(self, name):
+        """返回 uint8 掩膜（0 / 255），不存在时返回 None"""
+        entry = self._entry(name)
+        if entry is None:
+            return None
+        try:
+            data = np.load(os.path.join(self.root, entry["file"]), mmap_mode="r")
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        if not entry["packed"]:
+            return data
+        height, width = entry["shape"]
+        return np.unpackbits(data, axis=1, count=width) * np.uint8(255)
+
+    def delete(self, name):
+        with self._lock:
+            entry = self._entries().pop(name, None)
+            self._dirty.pop(name, None)
+            if entry is not None:
+                self._deleted.add(name)
+        if entry is None:
+            return
+        try:
+            os.remove(os.path.join(self.root, entry["file"]))
+        except FileNotFoundError:
+            pass
+        self.flush()
+
+    def export_png(self, name, path=None):
+        """
+        按需导出 PNG（默认 output/result_images/<name>_mask.png），返回路径；掩膜不存在时返回 None。
+        已导出的 PNG 比掩膜文件新时直接返回，不再重复解码和写盘。
+        """
+        entry = self._entry(name)
+        if entry is None:
+            return None
+        if path is None:
+            path = os.path.join(PNG_DIR, f"{os.path.splitext(name)[0]}_mask.png")
+        try:
+            if os.path.getmtime(path) >= os.path.getmtime(os.path.join(self.root, entry["file"])):
+                return path
+        except OSError:
+            pass
+        mask = self.get(name)
+        if mask is None:
+            return None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        cv2.imwrite(path, np.ascontiguousarray(mask))
+        return path
+
+
+# 全局掩膜存储（首次访问时才读取索引）
+mask_store = MaskStore()
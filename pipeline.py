@@ -0,0 +1,332 @@
+# pipeline.py
+
+import os
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from crack_predict_code.predict import (
+    encode_probability, preprocess, run_probability_tensors, run_probability_tiled, threshold_mask, weights_hash,
+)
+from crack_quantification.parallel import SharedMemoryQuantifier
+from mask_store import mask_store
+from result_cache import result_cache, hash_bytes, make_key
+from instrumentation import log_event, metrics, stage
+
+_DONE = object()  # 各级队列的结束标记
+PROBABILITY_DIR = "output/probability"
+
+
+def save_result_images(image_path, mask_uint8, width_vis, flush=True, source=None):
+    """
+    掩膜写入 mask_store（需要 PNG 时用 mask_store.export_png 导出），宽度可视化图保存为 PNG。
+    source 为结果的缓存键：已保存的掩膜来自同一个 source 时跳过写盘，否则覆盖，
+    保证磁盘上的掩膜和宽度图始终与最近一次返回的结果一致。
+    """
+    fname = os.path.basename(image_path)
+
+    base_name = os.path.splitext(fname)[0]
+    output_dir = "output/result_images"
+    os.makedirs(output_dir, exist_ok=True)
+
+    width_path = os.path.join(output_dir, f"{base_name}_width.png")
+    if (source is not None and mask_store.source(fname) == source
+            and (width_vis is None) == (not os.path.exists(width_path))):
+        return
+
+    with stage("mask_store_put"):
+        mask_store.put(fname, mask_uint8, flush=flush, source=source)
+    if width_vis is not None:
+        with stage("png_write"):
+            cv2.imwrite(width_path, width_vis)
+    elif os.path.exists(width_path):
+        os.remove(width_path)  # 本次结果没有宽度图，删除旧结果留下的
+
+
+def _probability_paths(image_path):
+    """(PNG 路径, .npy 路径, 来源信息 .json 路径)"""
+    base = os.path.join(PROBABILITY_DIR, f"{os.path.splitext(os.path.basename(image_path))[0]}_prob")
+    return f"{base}.png", f"{base}.npy", f"{base}.json"
+
+
+def probability_meta(data, model_name="default", tiled=False, tile_size=896, stride=768):
+    """概率图的来源：图像内容哈希 + 模型权重哈希 + 切片参数，任一变化时已保存的概率图即失效"""
+    meta = {"image": hash_bytes(data), "model": weights_hash(model_name), "tiled": bool(tiled)}
+    if tiled:
+        meta.update(tile_size=tile_size, stride=stride)
+    return meta
+
+
+def probability_map_meta(image_path):
+    """读取已保存概率图的来源信息，没有时返回 None"""
+    try:
+        with open(_probability_paths(image_path)[2], "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def discard_probability_map(image_path):
+    for path in _probability_paths(image_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def reconcile_probability_map(image_path, data, model_name="default", tiled=False, tile_size=896, stride=768):
+    """
+    处理图像前调用，返回本次推理对应的概率图来源信息；已保存的概率图与之不一致
+    （图像被替换、换了模型或切片参数）时删除旧图，避免 requantify / threshold_sweep 用到过期的概率图。
+    """
+    meta = probability_meta(data, model_name, tiled, tile_size, stride)
+    if probability_map_path(image_path) is not None and probability_map_meta(image_path) != meta:
+        discard_probability_map(image_path)
+    return meta
+
+
+def save_probability_map(image_path, prob, dtype="uint8", meta=None):
+    """
+    保存概率图供之后重新设定阈值：uint8 存为无损 PNG，float16 存为 .npy；
+    meta（probability_meta 的返回值）另存为同名 .json，读取时据此校验概率图是否仍对应当前图像和模型。
+    同一图像只保留一种格式，返回保存路径。
+    """
+    os.makedirs(PROBABILITY_DIR, exist_ok=True)
+    encoded = prob if prob.dtype == np.dtype(dtype) else encode_probability(prob, dtype)
+    png_path, npy_path, meta_path = _probability_paths(image_path)
+    with stage("probability_write", dtype=dtype):
+        if dtype == "uint8":
+            cv2.imwrite(png_path, encoded)
+            stale, path = npy_path, png_path
+        else:
+            np.save(npy_path, encoded)
+            stale, path = png_path, npy_path
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta or {}, f, sort_keys=True)
+    if os.path.exists(stale):
+        os.remove(stale)
+    return path
+
+
+def probability_map_path(image_path):
+    """返回图像已保存的概率图路径，没有则返回 None"""
+    for path in _probability_paths(image_path)[:2]:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_probability_map(image_path, model_name=None):
+    """
+    读取 save_probability_map 保存的概率图（uint8 或 float16 编码）。
+    概率图不存在、或与当前图像内容（给出 model_name 时还有模型权重）不一致时返回 None。
+    """
+    path = probability_map_path(image_path)
+    if path is None:
+        return None
+    meta = probability_map_meta(image_path) or {}
+    with open(image_path, "rb") as f:
+        image_hash = hash_bytes(f.read())
+    if meta.get("image") != image_hash or (model_name is not None and meta.get("model") != weights_hash(model_name)):
+        print(f"⚠️ 概率图已过期（图像或模型已变化）：{os.path.basename(image_path)}")
+        return None
+    if path.endswith(".npy"):
+        return np.load(path)
+    return cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+
+
+def make_cache_key(data, pixel_size_mm, tiled=False, tile_size=896, stride=768, per_crack=False,
+                   model_name="default", threshold=0.5):
+    params = {"tiled": bool(tiled), "per_crack": bool(per_crack), "threshold": float(threshold)}
+    if tiled:
+        params.update(tile_size=tile_size, stride=stride)
+    return make_key(hash_bytes(data), weights_hash(model_name), pixel_size_mm, **params)
+
+
+def load_cached(image_path, cache_key, with_arrays=False):
+    """
+    缓存命中时返回结构化结果（必要时补写结果图像），未命中返回 None。
+    with_arrays=True 时返回 (result, mask_uint8, width_vis)。
+    """
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        return None
+    result, mask_uint8, width_vis = cached
+    result["Filename"] = os.path.basename(image_path)
+    save_result_images(image_path, mask_uint8, width_vis, source=cache_key)
+    return (result, mask_uint8, width_vis) if with_arrays else result
+
+
+def run_pipeline(image_paths, pixel_size_mm=0.1, batch_size=8, tiled=False, tile_size=896, stride=768,
+                 per_crack=False, use_cache=True, decode_workers=4, quant_workers=None, queue_size=16,
+                 model_name="default", threshold=0.5, save_probability=False, prob_dtype="uint8",
+                 on_result=None, streaming=False):
+    """
+    流水线批处理，各阶段并行重叠执行：
+      解码/预处理线程池 → 单一推理线程（攒满 batch_size 再前向）→ 量化进程池（共享内存传掩膜）→ 写盘线程
+    阶段之间用容量为 queue_size 的有界队列连接，下游跟不上时上游自动阻塞，内存占用有上限。
+    推理期间量化在其他 CPU 核上进行，模型始终保持工作状态。
+    threshold 为概率图二值化阈值；save_probability=True 时另存概率图（prob_dtype 为 uint8 或 float16），
+    之后可用 agent_main.requantify 换阈值重新量化而不必再跑模型。
+    on_result(result) 在每张图像完成时回调（已加锁，不会并发调用），可用于边处理边入库；
+    给出 on_result 时结果只交给回调、不再累积到返回列表，长时间运行时内存不会增长。
+    streaming=True 用于持续产出路径的数据源（如 ingest.DirectoryWatcher）：上游暂时没有新图像时
+    不再等批次攒满而是立即推理，失败信息也逐张打印，而不是等整批结束；
+    掩膜索引仍只在结束时写回，长时间运行时由调用方定期调用 mask_store.flush()。
+    返回结果列表（按完成顺序），失败的图像只打印错误、不中断整批。
+    """
+    quant_workers = quant_workers or max((os.cpu_count() or 2) - 1, 1)
+    decoded_q = queue.Queue(maxsize=queue_size)   # 解码任务的 future（保持提交顺序）
+    quant_q = queue.Queue(maxsize=queue_size)     # (path, cache_key, mask_uint8, 量化 future)
+    results, errors = [], []
+    result_lock = threading.Lock()
+
+    def fail(name, e):
+        if streaming:
+            _report_failure(name, e)
+        else:
+            errors.append((name, e))
+
+    def finish(result):
+        if on_result is None:
+            results.append(result)
+            return
+        with result_lock:
+            try:
+                on_result(result)
+            except Exception as e:
+                fail(result["Filename"], e)
+
+    def decode(path):
+        with stage("read"), open(path, "rb") as f:
+            data = f.read()
+        cache_key = (make_cache_key(data, pixel_size_mm, tiled, tile_size, stride, per_crack, model_name,
+                                    threshold) if use_cache else None)
+        meta = reconcile_probability_map(path, data, model_name, tiled, tile_size, stride)
+        # 缓存中没有概率图，需要保存概率图而磁盘上又没有时跳过缓存重新推理
+        if cache_key is not None and not (save_probability and probability_map_path(path) is None):
+            cached = load_cached(path, cache_key)
+            if cached is not None:
+                metrics.inc("cache_hits")
+                return path, cache_key, meta, None, cached
+
+        with stage("decode"):
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("无法读取图像")
+        # 切片模式在推理阶段按切片预处理；整图模式在这里完成预处理，推理线程只做前向
+        return path, cache_key, meta, image if tiled else preprocess(image), None
+
+    def feed(decode_pool):
+        try:
+            for path in image_paths:
+                decoded_q.put((path, decode_pool.submit(decode, path)))
+        finally:
+            decoded_q.put(_DONE)
+
+    def infer(quant_pool):
+        batch = []
+
+        def submit(path, cache_key, meta, prob):
+            with stage("threshold"):
+                mask_uint8 = (threshold_mask(prob, threshold) * 255).astype(np.uint8)
+            if save_probability:
+                try:
+                    save_probability_map(path, prob, prob_dtype, meta)
+                except Exception as e:
+                    fail(os.path.basename(path), e)
+                    return
+            try:
+                future = quant_pool.submit(mask_uint8, pixel_size_mm, per_crack=per_crack)
+            except Exception as e:
+                fail(os.path.basename(path), e)
+                return
+            quant_q.put((path, cache_key, mask_uint8, future))
+
+        def flush():
+            try:
+                probs = run_probability_tensors([tensor for *_, tensor in batch], model_name=model_name)
+            except Exception as e:
+                fail(", ".join(os.path.basename(p) for p, *_ in batch), e)
+                probs = []
+            for (path, cache_key, meta, _), prob in zip(batch, probs):
+                submit(path, cache_key, meta, prob)
+            batch.clear()
+
+        try:
+            while True:
+                # 流式模式下上游暂时没有新图像时，不再等批次攒满，先推理已有的部分
+                if streaming and batch and decoded_q.empty():
+                    flush()
+                item = decoded_q.get()
+                if item is _DONE:
+                    break
+                path, future = item
+                try:
+                    _, cache_key, meta, payload, cached = future.result()
+                except Exception as e:
+                    fail(os.path.basename(path), e)
+                    continue
+
+                if cached is not None:
+                    print(f"♻️ 使用缓存结果：{os.path.basename(path)}")
+                    finish(cached)
+                elif tiled:
+                    try:
+                        prob = run_probability_tiled(payload, tile_size=tile_size, stride=stride,
+                                                     model_name=model_name)
+                        submit(path, cache_key, meta, prob)
+                    except Exception as e:
+                        fail(os.path.basename(path), e)
+                else:
+                    batch.append((path, cache_key, meta, payload))
+                    if len(batch) >= batch_size:
+                        flush()
+            if batch:
+                flush()
+        finally:
+            quant_q.put(_DONE)
+
+    def write():
+        while True:
+            item = quant_q.get()
+            if item is _DONE:
+                break
+            path, cache_key, mask_uint8, future = item
+            fname = os.path.basename(path)
+            try:
+                row, width_vis = future.result()
+                save_result_images(path, mask_uint8, width_vis, flush=False, source=cache_key)
+                result = {"Filename": fname, **row}
+                if cache_key is not None:
+                    result_cache.put(cache_key, result, mask_uint8, width_vis)
+                print(f"分析图像：{fname}")
+                metrics.inc("images_processed")
+                finish(result)
+            except Exception as e:
+                fail(fname, e)
+        with stage("mask_store_flush"):
+            mask_store.flush()
+
+    with ThreadPoolExecutor(max_workers=decode_workers) as decode_pool, \
+            SharedMemoryQuantifier(workers=quant_workers) as quant_pool:
+        threads = [
+            threading.Thread(target=feed, args=(decode_pool,), name="pipeline-decode", daemon=True),
+            threading.Thread(target=infer, args=(quant_pool,), name="pipeline-infer", daemon=True),
+            threading.Thread(target=write, name="pipeline-write", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for fname, e in errors:
+        _report_failure(fname, e)
+    return results
+
+
+def _report_failure(fname, e):
+    metrics.inc("errors", stage="pipeline")
+    log_event("image_failed", filename=fname, error=str(e))
+    print(f"❌ 处理 {fname} 失败：{e}")
@@ -3,32 +3,43 @@
 import os
 import cv2
 import numpy as np
-from crack_predict_code.predict import run_prediction
+from crack_predict_code.predict import run_prediction, run_prediction_tiled
 from crack_quantification.quantifier import compute_features
+from mask_store import mask_store
+from instrumentation import stage, timed, profiled
 
-def process_image(image_path: str, pixel_size_mm: float = 0.1) -> dict:
+@profiled("process_image")
+@timed("process_image")
+def process_image(image_path: str, pixel_size_mm: float = 0.1, tiled: bool = False,
+                  tile_size: int = 896, stride: int = 768, threshold: float = 0.5) -> dict:
     """
     加载图像，进行分割预测与量化分析。
+    tiled=True 时按原始分辨率滑窗切片推理，掩膜与 pixel_size_mm 对应的像素网格一致。
+    threshold 为概率图二值化阈值。
     返回包含几何特征的字典。
     """
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"❌ 文件不存在：{image_path}")
 
-    img = cv2.imread(image_path)
+    with stage("decode"):
+        img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"❌ 图像读取失败：{image_path}")
 
     print(f"🔍 正在处理图像：{image_path}，尺寸：{img.shape}")
 
-    # 1. 分割预测（掩膜值为0或1）
-    mask = run_prediction(img)
+    # 1. 分割预测（掩膜值为0或1），前向计算由 predict 模块记为 forward 阶段，与批处理一致
+    if tiled:
+        mask = run_prediction_tiled(img, tile_size=tile_size, stride=stride, threshold=threshold)
+    else:
+        mask = run_prediction(img, threshold=threshold)
 
-    # 2. 保存掩膜图像（用于调试）
-    os.makedirs("output", exist_ok=True)
-    mask_save_path = os.path.join("output", os.path.basename(image_path).replace(".jpg", "_mask.png"))
-    cv2.imwrite(mask_save_path, (mask * 255).astype("uint8"))
-    print(f"📤 掩膜已保存：{mask_save_path}")
+    # 2. 掩膜写入掩膜存储（与批处理共用，需要 PNG 时用 mask_store.export_png 导出）
+    mask_uint8 = (mask * 255).astype("uint8")
+    with stage("mask_store_put"):
+        mask_store.put(os.path.basename(image_path), mask_uint8)
+    print(f"📤 掩膜已保存：{os.path.basename(image_path)}")
 
     # 3. 几何量化分析（掩膜需转换为 uint8 图）
-    result = compute_features((mask * 255).astype("uint8"), pixel_size_mm)
+    result = compute_features(mask_uint8, pixel_size_mm)
     return result
@@ -0,0 +1,200 @@
+# result_cache.py
+
+import os
+import io
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_DIR = "output/cache"
+MAX_CACHE_BYTES = 2 * 1024 ** 3   # 磁盘缓存上限，超出后按最近访问时间淘汰
+MAX_MEMORY_BYTES = 256 * 1024 ** 2  # 进程内热缓存中掩膜和宽度图的总字节数上限（大幅面图像单张即可达数百 MB）
+EVICT_TO_FRACTION = 0.9           # 超出上限时淘汰到上限的这一比例，避免之后每次写入都触发扫描
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(image_hash: str, model_hash: str, pixel_size_mm: float, **params) -> str:
+    """
+    缓存键 = 图像内容哈希 + 模型权重哈希 + 像素尺寸 + 其他影响结果的参数（tiled、per_crack 等）。
+    任何一项变化都会得到不同的键，旧条目自然失效并最终被淘汰。
+    """
+    payload = json.dumps({
+        "image": image_hash,
+        "model": model_hash,
+        "pixel_size_mm": float(pixel_size_mm),
+        "params": params,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _to_builtin(value):
+    """把 numpy 标量转换为 JSON 可序列化的 Python 内置类型"""
+    if isinstance(value, dict):
+        return {k: _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ResultCache:
+    """
+    以内容哈希为键的持久化结果缓存：每个条目是一个压缩 npz，包含掩膜、宽度可视化图和特征字典。
+    磁盘条目按文件修改时间做 LRU（命中时刷新），总大小超过 max_bytes 时淘汰最久未用的条目
+    （总大小首次写入时统计一次、之后增量维护，只有超出上限时才扫描目录排序）；
+    另有一个按字节数限制的进程内 LRU（memory_bytes），重复查询无需再读盘。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, memory_bytes=MAX_MEMORY_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()
+        self._memory_total = 0    # 进程内 LRU 中数组的总字节数
+        self._total_bytes = None  # 磁盘条目总大小，首次写入时才统计
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        """命中时返回 (result, mask, width_vis)，否则返回 None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                entry = self._memory[key]
+                self._touch(key)
+                return copy.deepcopy(entry[0]), entry[1], entry[2]
+
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                result = json.loads(str(data["result"]))
+                mask = data["mask"]
+                width_vis = data["width_vis"] if data["width_vis"].size else None
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+        with self._lock:
+            self._remember(key, (result, mask, width_vis))
+            self._touch(key)
+        return copy.deepcopy(result), mask, width_vis
+
+    def put(self, key, result, mask, width_vis=None):
+        result = _to_builtin(result)
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            result=np.array(json.dumps(result, ensure_ascii=False)),
+            mask=mask,
+            width_vis=width_vis if width_vis is not None else np.zeros(0, dtype=np.uint8),
+        )
+
+        # 先写临时文件再原子替换，并发进程不会读到半个条目
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data = buffer.getvalue()
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._remember(key, (result, mask, width_vis))
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._entries())
+            else:
+                self._total_bytes += len(data) - replaced
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_total = 0
+            self._total_bytes = 0
+        for _, path, _ in self._entries():
+            self._remove(path)
+
+    @staticmethod
+    def _array_bytes(entry):
+        return sum(a.nbytes for a in entry[1:] if a is not None)
+
+    def _forget(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_total -= self._array_bytes(entry)
+
+    def _remember(self, key, entry):
+        self._forget(key)
+        size = self._array_bytes(entry)
+        if size > self.memory_bytes:  # 单个条目就超出上限时不进内存，只留在磁盘上
+            return
+        self._memory[key] = entry
+        self._memory_total += size
+        while self._memory_total > self.memory_bytes:
+            self._forget(next(iter(self._memory)))
+
+    def _touch(self, key):
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        # 重新扫描得到准确的总大小（其他进程也可能写入或淘汰过条目）
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        if total <= self.max_bytes:
+            with self._lock:
+                self._total_bytes = total
+            return
+        for _, path, size in entries:
+            if total <= self.max_bytes * EVICT_TO_FRACTION:
+                break
+            self._remove(path)
+            total -= size
+            key = os.path.splitext(os.path.basename(path))[0]
+            with self._lock:
+                self._forget(key)
+        with self._lock:
+            self._total_bytes = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# 全局共享缓存（首次读写时才访问磁盘）
+result_cache = ResultCache()
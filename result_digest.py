@@ -0,0 +1,86 @@
+# result_digest.py
+
+import numpy as np
+import pandas as pd
+
+METRIC_COLUMNS = ["Max Width (mm)", "Avg Width (mm)", "Length (mm)", "Area (mm^2)", "Area Ratio"]
+COMPLIANCE_COLUMNS = ["Max Width OK", "Avg Width OK", "Area Ratio OK", "Length OK"]
+WIDTH_BINS = [0.0, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, np.inf]  # 最大宽度分布直方图的区间（mm）
+
+
+def compute_digest(df: pd.DataFrame, top_k: int = 5) -> dict:
+    """
+    结果表的本地统计摘要：图像数、各指标分布（均值/分位数/最值）、最大宽度所在图像、
+    各项合规检查的不合格数、最大宽度直方图以及不合格图像中最大宽度前 top_k 名。
+    摘要大小固定，与图像数量无关，可直接放进 LLM 提示词。
+    """
+    df = df.copy()
+    flags = [col for col in COMPLIANCE_COLUMNS if col in df.columns]
+    for col in flags:
+        if df[col].dtype != bool:
+            df[col] = df[col].astype(str).str.lower().isin(["true", "1", "1.0"])
+    compliant = df[flags].all(axis=1) if flags else pd.Series(True, index=df.index)
+
+    digest = {
+        "images": int(len(df)),
+        "compliant": int(compliant.sum()),
+        "non_compliant": int((~compliant).sum()),
+        "failures_by_check": {col: int((~df[col]).sum()) for col in flags},
+        "metrics": {},
+    }
+
+    for col in METRIC_COLUMNS:
+        if col not in df.columns:
+            continue
+        values = pd.to_numeric(df[col], errors="coerce").dropna().to_numpy()
+        if values.size == 0:
+            continue
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        digest["metrics"][col] = {
+            "mean": round(float(values.mean()), 3), "p50": round(float(p50), 3), "p90": round(float(p90), 3),
+            "p99": round(float(p99), 3), "min": round(float(values.min()), 3), "max": round(float(values.max()), 3),
+        }
+
+    if "Max Width (mm)" in df.columns and len(df):
+        width = pd.to_numeric(df["Max Width (mm)"], errors="coerce")
+        if width.notna().any():
+            idx = width.idxmax()
+            digest["max_width_image"] = {"Filename": str(df.at[idx, "Filename"]), "Max Width (mm)": float(width[idx])}
+            counts, _ = np.histogram(width.dropna().to_numpy(), bins=WIDTH_BINS)
+            digest["max_width_histogram"] = {
+                f"{lo:g}-{hi:g}" if np.isfinite(hi) else f">{lo:g}": int(n)
+                for lo, hi, n in zip(WIDTH_BINS[:-1], WIDTH_BINS[1:], counts)
+            }
+            # 宽度缺失的不合规图像无法按宽度排序，不列入（否则提示词里会出现 "nan mm"）
+            ranked = ~compliant & width.notna()
+            offenders = df[ranked].assign(_w=width[ranked]).nlargest(top_k, "_w")
+            digest["top_offenders"] = [
+                {"Filename": str(row["Filename"]), "Max Width (mm)": float(row["_w"]),
+                 "failed": [col.replace(" OK", "") for col in flags if not row[col]]}
+                for _, row in offenders.iterrows()
+            ]
+
+    return digest
+
+
+def format_digest(digest: dict) -> str:
+    """把摘要排成紧凑的文本（每项一行），供提示词使用"""
+    lines = [
+        f"Images analyzed: {digest['images']}",
+        f"Compliant: {digest['compliant']}, non-compliant: {digest['non_compliant']}",
+    ]
+    if digest["failures_by_check"]:
+        lines.append("Failures by check: " + ", ".join(f"{k}: {v}" for k, v in digest["failures_by_check"].items()))
+    if "max_width_image" in digest:
+        top = digest["max_width_image"]
+        lines.append(f"Maximum crack width: {top['Max Width (mm)']} mm in {top['Filename']}")
+    for col, stats in digest["metrics"].items():
+        lines.append(f"{col}: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+    if "max_width_histogram" in digest:
+        lines.append("Max width distribution (mm → images): "
+                     + ", ".join(f"{k}: {v}" for k, v in digest["max_width_histogram"].items()))
+    if digest.get("top_offenders"):
+        lines.append("Top non-compliant images by max width:")
+        lines.extend(f"  - {o['Filename']}: {o['Max Width (mm)']} mm, failed {', '.join(o['failed']) or 'none'}"
+                     for o in digest["top_offenders"])
+    return "\n".join(lines)
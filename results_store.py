@@ -0,0 +1,237 @@
+# results_store.py
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+
+RESULTS_DB = "output/results.db"
+
+# (结果字典中的字段名, 数据库列名, 类型)
+IMAGE_COLUMNS = [
+    ("Max Width (mm)", "max_width_mm", "REAL"),
+    ("Avg Width (mm)", "avg_width_mm", "REAL"),
+    ("Length (mm)", "length_mm", "REAL"),
+    ("Area (mm^2)", "area_mm2", "REAL"),
+    ("Area Ratio", "area_ratio", "REAL"),
+    ("Max Width OK", "max_width_ok", "INTEGER"),
+    ("Avg Width OK", "avg_width_ok", "INTEGER"),
+    ("Area Ratio OK", "area_ratio_ok", "INTEGER"),
+    ("Length OK", "length_ok", "INTEGER"),
+]
+CRACK_COLUMNS = [
+    ("Crack ID", "crack_id", "INTEGER"),
+    ("Area (mm^2)", "area_mm2", "REAL"),
+    ("Length (mm)", "length_mm", "REAL"),
+    ("Avg Width (mm)", "avg_width_mm", "REAL"),
+    ("Max Width (mm)", "max_width_mm", "REAL"),
+    ("Endpoints", "endpoints", "INTEGER"),
+    ("Branch Points", "branch_points", "INTEGER"),
+    ("BBox X", "bbox_x", "INTEGER"),
+    ("BBox Y", "bbox_y", "INTEGER"),
+    ("BBox W", "bbox_w", "INTEGER"),
+    ("BBox H", "bbox_h", "INTEGER"),
+    ("Max Width OK", "max_width_ok", "INTEGER"),
+    ("Avg Width OK", "avg_width_ok", "INTEGER"),
+    ("Length OK", "length_ok", "INTEGER"),
+]
+COMPLIANCE_COLUMNS = ["Max Width OK", "Avg Width OK", "Area Ratio OK", "Length OK"]
+BOOL_COLUMNS = {"Max Width OK", "Avg Width OK", "Area Ratio OK", "Length OK", "Compliant"}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    pixel_size_mm REAL,
+    threshold REAL,
+    model_hash TEXT,
+    params TEXT,
+    images INTEGER
+);
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    filename TEXT NOT NULL,
+    {", ".join(f"{col} {kind}" for _, col, kind in IMAGE_COLUMNS)},
+    compliant INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cracks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_id INTEGER NOT NULL REFERENCES images(id),
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    filename TEXT NOT NULL,
+    {", ".join(f"{col} {kind}" for _, col, kind in CRACK_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS idx_images_filename ON images(filename);
+CREATE INDEX IF NOT EXISTS idx_images_run_compliant ON images(run_id, compliant);
+CREATE INDEX IF NOT EXISTS idx_images_compliant ON images(compliant);
+CREATE INDEX IF NOT EXISTS idx_cracks_image ON cracks(image_id);
+CREATE INDEX IF NOT EXISTS idx_cracks_run ON cracks(run_id);
+"""
+
+
+class ResultsStore:
+    """
+    SQLite 结果库：runs（运行参数：像素尺寸、阈值、模型哈希）、images（逐图像指标）、cracks（逐条裂缝指标）三张表，
+    文件名和合规标志上建有索引，按条件过滤时不必读出整张表。
+    使用 WAL 模式，每个线程一个连接，多个线程/进程可以同时追加结果（写入时短暂串行）。
+    查询结果为 DataFrame，列名与原 CSV 一致；CSV 仍可通过 export_csv 导出。
+    """
+
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._init_lock:
+            if not self._initialized:
+                conn.executescript(SCHEMA)
+                self._initialized = True
+        self._local.conn = conn
+        return conn
+
+    def start_run(self, params: dict) -> int:
+        """登记一次运行，返回 run_id；params 中的 pixel_size_mm / threshold / model 单独成列，其余存为 JSON"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (started_at, pixel_size_mm, threshold, model_hash, params) VALUES (?, ?, ?, ?, ?)",
+                (time.time(), params.get("pixel_size_mm"), params.get("threshold"), params.get("model"),
+                 json.dumps(params, sort_keys=True)),
+            )
+        return cursor.lastrowid
+
+    def finish_run(self, run_id: int):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE runs SET finished_at = ?, images = (SELECT COUNT(*) FROM images WHERE run_id = ?) "
+                "WHERE id = ?",
+                (time.time(), run_id, run_id),
+            )
+
+    def add_results(self, run_id: int, results):
+        """追加一批结果（每个为带 Filename 的结果字典，可含 "Cracks" 逐条裂缝表），在一个事务中写入"""
+        conn = self._connect()
+        image_sql = (f"INSERT INTO images (run_id, filename, {', '.join(col for _, col, _ in IMAGE_COLUMNS)}, "
+                     f"compliant, created_at) VALUES ({', '.join('?' * (len(IMAGE_COLUMNS) + 4))})")
+        crack_sql = (f"INSERT INTO cracks (image_id, run_id, filename, {', '.join(col for _, col, _ in CRACK_COLUMNS)}) "
+                     f"VALUES ({', '.join('?' * (len(CRACK_COLUMNS) + 3))})")
+        now = time.time()
+        with stage("results_store_write"), conn:
+            for result in results:
+                values = [_to_sql(result.get(key)) for key, _, _ in IMAGE_COLUMNS]
+                compliant = all(bool(result.get(key)) for key in COMPLIANCE_COLUMNS)
+                cursor = conn.execute(image_sql, [run_id, result["Filename"], *values, int(compliant), now])
+                image_id = cursor.lastrowid
+                conn.executemany(crack_sql, [
+                    [image_id, run_id, result["Filename"], *(_to_sql(crack.get(key)) for key, _, _ in CRACK_COLUMNS)]
+                    for crack in result.get("Cracks", [])
+                ])
+
+    def latest_run_id(self):
+        row = self._connect().execute("SELECT MAX(id) FROM runs").fetchone()
+        return row[0]
+
+    def runs(self) -> pd.DataFrame:
+        return pd.read_sql_query("SELECT * FROM runs ORDER BY id", self._connect())
+
+    def filenames(self) -> set:
+        return {row[0] for row in self._connect().execute("SELECT DISTINCT filename FROM images")}
+
+    def query_images(self, run_id=None, compliant=None, filenames=None, latest=True) -> pd.DataFrame:
+        """
+        按条件查询逐图像结果，例如 query_images(run_id=3, compliant=False) 为第 3 次运行中不合规的图像。
+        不限定 run_id 且 latest=True 时每个文件名只取最新一条，即当前的结果表。
+        """
+        where, args = self._filters(run_id, compliant, filenames)
+        if latest and run_id is None:
+            where.append("images.id IN (SELECT MAX(id) FROM images GROUP BY filename)")
+        columns = ", ".join(f'images.{col} AS "{key}"' for key, col, _ in IMAGE_COLUMNS)
+        sql = (f'SELECT images.filename AS "Filename", {columns}, images.compliant AS "Compliant", '
+               f'images.run_id AS "Run ID" FROM images')
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return _restore_bools(pd.read_sql_query(sql + " ORDER BY images.id", self._connect(), params=args))
+
+    def query_cracks(self, run_id=None, compliant=None, filenames=None, latest=True) -> pd.DataFrame:
+        """查询逐条裂缝结果，过滤条件作用于裂缝所属图像（compliant 为图像整体是否合规）"""
+        where, args = self._filters(run_id, compliant, filenames)
+        if latest and run_id is None:
+            where.append("images.id IN (SELECT MAX(id) FROM images GROUP BY filename)")
+        columns = ", ".join(f'cracks.{col} AS "{key}"' for key, col, _ in CRACK_COLUMNS)
+        sql = (f'SELECT cracks.filename AS "Filename", {columns} FROM cracks '
+               f'JOIN images ON images.id = cracks.image_id')
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return _restore_bools(pd.read_sql_query(sql + " ORDER BY cracks.id", self._connect(), params=args))
+
+    @staticmethod
+    def _filters(run_id, compliant, filenames):
+        where, args = [], []
+        if run_id is not None:
+            where.append("images.run_id = ?")
+            args.append(run_id)
+        if compliant is not None:
+            where.append("images.compliant = ?")
+            args.append(int(compliant))
+        if filenames is not None:
+            filenames = list(filenames)
+            where.append(f"images.filename IN ({', '.join('?' * len(filenames))})")
+            args.extend(filenames)
+        return where, args
+
+    def export_csv(self, path, run_id=None, cracks=False):
+        """导出与旧版 output/result_metrics.csv（cracks=True 时为 result_cracks.csv）列名一致的 CSV"""
+        if cracks:
+            df = self.query_cracks(run_id=run_id)
+        else:
+            df = self.query_images(run_id=run_id).drop(columns=["Compliant", "Run ID"])
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        df.to_csv(path, index=False)
+        return df
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _to_sql(value):
+    """numpy 标量 / bool 转为 SQLite 可存的 Python 内置类型"""
+    if isinstance(value, np.floating):
+        return float(str(value))  # float32 按其最短十进制表示转换，避免 21.2 变成 21.200000762939453
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _restore_bools(df):
+    for column in df.columns:
+        if column in BOOL_COLUMNS:
+            df[column] = df[column].astype(bool)
+    return df
+
+
+# 全局结果库（首次访问时才连接数据库）
+results_store = ResultsStore()
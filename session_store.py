@@ -0,0 +1,71 @@
+import time
+import threading
+from collections import OrderedDict
+
+MAX_SESSIONS = 1000      # sessions kept in memory; least recently used are dropped first
+SESSION_TTL_S = 3600     # sessions idle for longer than this are evicted
+
+
+class SessionState:
+    """Per-session agent memory: the structured result of the last analyzed image."""
+
+    __slots__ = ("result", "result_text", "image_path", "updated_at")
+
+    def __init__(self):
+        self.result = None        # feature dict from agent_main.process_image
+        self.result_text = None   # tool reply shown to the user
+        self.image_path = None
+        self.updated_at = time.monotonic()
+
+
+class SessionStore:
+    """
+    Thread-safe session-keyed state with LRU bounding and idle TTL eviction.
+    get() creates a session on first use and refreshes its last-access time.
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl_s=SESSION_TTL_S):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id) -> SessionState:
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = self._sessions[session_id] = SessionState()
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            state.updated_at = now
+            return state
+
+    def update(self, session_id, result=None, result_text=None, image_path=None):
+        state = self.get(session_id)
+        with self._lock:
+            state.result = result
+            state.result_text = result_text
+            state.image_path = image_path
+        return state
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _evict(self, now):
+        # Sessions are ordered by last access, so expired ones are always at the front
+        while self._sessions:
+            session_id, state = next(iter(self._sessions.items()))
+            if now - state.updated_at <= self.ttl_s:
+                break
+            self._sessions.popitem(last=False)
+
+
+sessions = SessionStore()
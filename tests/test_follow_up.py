@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from agent_executor import agent_respond_stream, answer_follow_up
+from intent_router import route_intent
+from session_store import sessions
+
+RESULT = {
+    "Max Width (mm)": 0.42, "Avg Width (mm)": 0.18, "Area (mm^2)": 12.5, "Length (mm)": 88.0,
+    "Max Width OK": False, "Avg Width OK": True, "Area Ratio OK": True, "Length OK": True,
+}
+
+FOLLOW_UPS = [
+    ("how long is the crack", "Length: 88.0 mm"),
+    ("what is the maximum width?", "Max Width: 0.42 mm"),
+    ("what is the max width?", "Max Width: 0.42 mm"),
+    ("and the average width", "Avg Width: 0.18 mm"),
+    ("what's the area", "Area: 12.5 mm²"),
+    ("is it compliant", "Compliance: {'Max Width OK': False, 'Avg Width OK': True, 'Area Ratio OK': True, "
+                        "'Length OK': True}"),
+]
+
+
+@pytest.mark.parametrize("user_input, expected", FOLLOW_UPS)
+def test_routed_follow_up_is_answered_from_result(user_input, expected):
+    parsed = route_intent(user_input)
+    assert parsed["tool"] == "none"
+    assert answer_follow_up(parsed["parameters"]["query"], RESULT) == expected
+
+
+@pytest.mark.parametrize("user_input, expected", FOLLOW_UPS)
+def test_agent_respond_stream_answers_routed_follow_up(user_input, expected):
+    session_id = f"test-follow-up-{user_input}"
+    sessions.update(session_id, result=RESULT, result_text="", image_path="input_images/0_crack.jpg")
+
+    async def turn():
+        return [reply async for reply, _ in agent_respond_stream(user_input, session_id=session_id)]
+
+    try:
+        assert asyncio.run(turn()) == [expected]
+    finally:
+        sessions.drop(session_id)
+
+
+def test_agent_respond_stream_yields_the_tool_result_arrays(monkeypatch):
+    import numpy as np
+
+    import agent_executor
+    from tools import ToolResult
+
+    images = {
+        "original": np.zeros((4, 6, 3), dtype=np.uint8),
+        "mask": np.full((4, 6), 255, dtype=np.uint8),
+        "width": np.zeros((4, 6, 3), dtype=np.uint8),
+    }
+    images["original"][..., 0] = 1  # BGR blue channel
+    monkeypatch.setitem(agent_executor.function_map, "analyze_one_image",
+                        lambda args: ToolResult("✅ done", data=RESULT, images=images))
+    session_id = "test-arrays"
+
+    async def turn():
+        return [item async for item in agent_respond_stream("analyze input_images/0_crack.jpg",
+                                                            with_arrays=True, session_id=session_id)]
+
+    try:
+        (_, status_images), (reply, arrays) = asyncio.run(turn())
+    finally:
+        sessions.drop(session_id)
+    assert status_images == {} and reply == "✅ done"
+    assert arrays["original"][0, 0].tolist() == [0, 0, 1]  # converted to RGB for the UI
+    assert arrays["mask"] is images["mask"]
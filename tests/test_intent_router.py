@@ -0,0 +1,62 @@
+import pytest
+
+from intent_router import route_intent
+
+
+def analyze_one(**params):
+    return {"tool": "analyze_one_image", "parameters": params}
+
+
+def analyze_all(**params):
+    return {"tool": "analyze_all_images", "parameters": params}
+
+
+def follow_up(query):
+    return {"tool": "none", "parameters": {"query": query}}
+
+
+ROUTES = [
+    # Single images: path, bare filename, ordinal, "image N", pixel size
+    ("analyze input_images/3_crack.jpg", analyze_one(image_path="input_images/3_crack.jpg")),
+    ("show me 7_crack.png", analyze_one(image_path="input_images/7_crack.png")),
+    ("segment the second image", analyze_one(image_index=1)),
+    ("process the last image", analyze_one(image_path="auto_last")),
+    ("analyze image 3 with 0.2mm pixels", analyze_one(image_index=2, pixel_size=0.2)),
+    ("image 0 please", None),
+    # Whole folder
+    ("analyze all images", analyze_all()),
+    ("process every image at 0.25 mm", analyze_all(pixel_size=0.25)),
+    ("all images", None),
+    # Summaries
+    ("summarize the results", {"tool": "summarize_results", "parameters": {}}),
+    ("give me a report at 0.1mm", None),
+    # Follow-ups about the last analyzed image
+    ("what is the max width?", follow_up("max width")),
+    ("how long is the crack", follow_up("length")),
+    ("is it compliant", follow_up("compliance")),
+    ("any repair advice?", follow_up("repair advice")),
+    ("how do I repair this crack", follow_up("repair advice")),
+    # Negations are left to the LLM
+    ("do not analyze all images", None),
+    ("don't process the second image", None),
+    ("skip 3_crack.jpg", None),
+    # Advice/repair wording with an image or folder scope is not an analysis request
+    ("repair the batch processing script", None),
+    ("how should I fix the crack in 3_crack.jpg", None),
+    ("recommend repairs for all images", None),
+    # Aggregate questions span several images and are not answered from the last one
+    ("which image has the largest area?", None),
+    ("how many images are non-compliant?", None),
+    ("what is the average width across the images", None),
+    # Conflicting scopes and ambiguous input
+    ("summarize 3_crack.jpg", None),
+    ("analyze 3_crack.jpg and all images", None),
+    ("analyze at 0.1mm or 0.2mm", None),
+    ("", None),
+    ("hello", None),
+]
+
+
+@pytest.mark.parametrize("user_input, expected", ROUTES)
+def test_route_intent(user_input, expected):
+    assert route_intent(user_input) == expected
@@ -0,0 +1,37 @@
+import time
+
+from agent_parser import _is_intent_json
+from llm_client import LLMClient, ResponseCache
+
+
+def test_unparseable_replies_are_not_cached(tmp_path):
+    replies = iter(["Sure! Here is the JSON:", '{"tool": "none", "parameters": {}}'])
+    client = LLMClient(backend="stub", cache_path=str(tmp_path / "cache.db"),
+                       responder=lambda messages, model, **params: next(replies))
+    messages = [{"role": "user", "content": "parse this"}]
+
+    assert client.chat(messages, validate=_is_intent_json) == "Sure! Here is the JSON:"
+    assert client.chat(messages, validate=_is_intent_json) == '{"tool": "none", "parameters": {}}'
+    assert client.chat(messages, validate=_is_intent_json) == '{"tool": "none", "parameters": {}}'
+    assert (client.hits, client.misses) == (1, 2)
+
+
+def test_cache_evicts_oldest_entries_past_the_limit(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_entries=10)
+    for i in range(11):
+        cache.put(f"k{i}", "m", f"r{i}")
+
+    # over the limit: evicted down to 90% of max_entries, oldest first
+    remaining = [i for i in range(11) if cache.get(f"k{i}") is not None]
+    assert remaining == list(range(2, 11))
+
+
+def test_cache_ignores_expired_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_age_s=60)
+    cache.put("old", "m", "stale")
+    with cache._connect() as conn:
+        conn.execute("UPDATE responses SET created_at = ?", (time.time() - 120,))
+
+    assert cache.get("old") is None
+    cache.put("new", "m", "fresh")
+    assert cache._connect().execute("SELECT key FROM responses").fetchall() == [("new",)]
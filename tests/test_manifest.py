@@ -0,0 +1,22 @@
+from manifest import load_manifest, save_manifest, update_manifest
+
+
+def test_update_keeps_entries_written_by_other_processes(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    save_manifest({"a.jpg": {"sha256": "a"}}, path)
+
+    # another process adds b.jpg after this one loaded the manifest
+    save_manifest({"a.jpg": {"sha256": "a"}, "b.jpg": {"sha256": "b"}}, path)
+    merged = update_manifest({"a.jpg": {"sha256": "a2"}, "c.jpg": {"sha256": "c"}}, path)
+
+    expected = {"a.jpg": {"sha256": "a2"}, "b.jpg": {"sha256": "b"}, "c.jpg": {"sha256": "c"}}
+    assert merged == expected
+    assert load_manifest(path) == expected
+
+
+def test_replace_drops_existing_entries(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    save_manifest({"a.jpg": {"sha256": "a"}}, path)
+
+    assert update_manifest({"b.jpg": {"sha256": "b"}}, path, replace=True) == {"b.jpg": {"sha256": "b"}}
+    assert load_manifest(path) == {"b.jpg": {"sha256": "b"}}
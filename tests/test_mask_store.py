@@ -0,0 +1,51 @@
+import json
+
+import numpy as np
+import pytest
+
+from mask_store import INDEX_NAME, MaskStore
+
+
+def _mask(seed, shape=(5, 13)):
+    # width not a multiple of 8, so packed masks need the unpack count to round-trip
+    return (np.random.default_rng(seed).random(shape) > 0.5).astype(np.uint8) * 255
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_put_get_round_trip(tmp_path, packed):
+    store = MaskStore(str(tmp_path), packed=packed)
+    mask = _mask(0)
+    store.put("a.jpg", mask, source="key-a")
+
+    reopened = MaskStore(str(tmp_path), packed=not packed)  # the entry records how it was stored
+    loaded = reopened.get("a.jpg")
+    assert loaded.dtype == np.uint8 and loaded.shape == mask.shape
+    assert np.array_equal(loaded, mask)
+    assert reopened.source("a.jpg") == "key-a"
+
+
+def test_names_differing_only_in_extension_do_not_collide(tmp_path):
+    store = MaskStore(str(tmp_path))
+    store.put("a.jpg", _mask(1))
+    store.put("a.png", _mask(2))
+
+    assert np.array_equal(store.get("a.jpg"), _mask(1))
+    assert np.array_equal(store.get("a.png"), _mask(2))
+
+
+def test_flush_merges_entries_from_other_processes(tmp_path):
+    # two stores on one directory stand in for two processes with their own in-memory index
+    first, second = MaskStore(str(tmp_path)), MaskStore(str(tmp_path))
+    first.put("keep.jpg", _mask(3))
+    first.put("drop.jpg", _mask(4))
+    assert second.names() == ["drop.jpg", "keep.jpg"]
+
+    first.put("a.jpg", _mask(5), flush=False)
+    second.put("b.jpg", _mask(6), flush=False)
+    second.delete("drop.jpg")  # flushes b.jpg and the delete
+    first.flush()
+
+    with open(tmp_path / INDEX_NAME, encoding="utf-8") as f:
+        assert sorted(json.load(f)) == ["a.jpg", "b.jpg", "keep.jpg"]
+    assert first.names() == ["a.jpg", "b.jpg", "keep.jpg"]
+    assert np.array_equal(MaskStore(str(tmp_path)).get("b.jpg"), _mask(6))
@@ -1,19 +1,22 @@
 import os
 import re
 import cv2
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from openai import OpenAI
-from agent_main import main as process_all_images, process_image
+from llm_client import chat
+from mask_store import mask_store
+from results_store import results_store
+from result_digest import COMPLIANCE_COLUMNS, compute_digest, format_digest
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # ========= Tool 1: analyze_all_images =========
-def analyze_all_images(pixel_size: float = 0.1) -> str:
-    if os.path.exists("output/result_metrics.csv"):
-        return f"✅ Results already exist (pixel size {pixel_size} mm): output/result_metrics.csv, no need to re-analyze."
-    process_all_images(pixel_size_mm=pixel_size)
+def analyze_all_images(pixel_size: float = 0.1, batch_size: int = 8) -> str:
+    # 延迟导入：只有真正做分割时才加载 torch 与分割流水线，summarize_results 等工具启动更快
+    from agent_main import main as process_all_images
+    # 结果缓存按图像内容、模型权重和像素尺寸判断，只有新增或改动的图像会重新推理
+    process_all_images(pixel_size_mm=pixel_size, batch_size=batch_size)
     return f"✅ All images have been processed (pixel size {pixel_size} mm). Results saved to output/result_metrics.csv"
 
 analyze_all_images_spec = {
@@ -33,13 +36,28 @@ analyze_all_images_spec = {
 }
 
 # ========= Tool 2: analyze_one_image =========
+class ToolResult(str):
+    """
+    Tool reply text that also carries the structured result (e.g. the feature dict) in .data
+    and the result's in-memory images ({"original", "mask", "width"}) in .images.
+    """
+
+    def __new__(cls, text, data=None, images=None):
+        obj = super().__new__(cls, text)
+        obj.data = data
+        obj.images = images
+        return obj
+
+
 def analyze_one_image(image_path: str, pixel_size: float = 0.1) -> str:
     if not os.path.exists(image_path):
         return f"❌ File not found: {image_path}"
+    from agent_main import process_image
     try:
-        result = process_image(image_path, pixel_size_mm=pixel_size)
-        return f"✅ Successfully analyzed: {os.path.basename(image_path)} (pixel size {pixel_size} mm)\n" + \
+        result, images = process_image(image_path, pixel_size_mm=pixel_size, return_images=True)
+        text = f"✅ Successfully analyzed: {os.path.basename(image_path)} (pixel size {pixel_size} mm)\n" + \
                "\n".join([f"{k}: {v}" for k, v in result.items()])
+        return ToolResult(text, data=result, images=images)
     except Exception as e:
         return f"❌ Analysis failed: {type(e).__name__} - {e}"
 
@@ -59,23 +77,24 @@ analyze_one_image_spec = {
 # ========= Tool 3: summarize_results =========
 def summarize_results() -> str:
     csv_path = "output/result_metrics.csv"
-    if not os.path.exists(csv_path):
+    # Latest result per image from the results store; fall back to a CSV from older runs
+    df = results_store.query_images() if os.path.exists(results_store.path) else None
+    if (df is None or df.empty) and not os.path.exists(csv_path):
         return "❌ Result file not found. Please run image analysis first."
 
     try:
-        df = pd.read_csv(csv_path)
+        if df is None or df.empty:
+            df = pd.read_csv(csv_path)
         if df.empty:
             return "❌ Result file is found but empty. Please check if analysis completed successfully."
-        if "Compliance" not in df.columns:
-            compliance_columns = ["Max Width OK", "Avg Width OK", "Area Ratio OK", "Length OK"]
-            if all(col in df.columns for col in compliance_columns):
-                df["Compliance"] = df[compliance_columns].all(axis=1)
-            else:
-                return "❌ Cannot summarize: missing required compliance fields in result file."
+        if not any(col in df.columns for col in COMPLIANCE_COLUMNS):
+            return "❌ Cannot summarize: missing required compliance fields in result file."
 
+        # Aggregate locally; the prompt only carries a fixed-size digest, whatever the number of images
+        digest = format_digest(compute_digest(df))
         prompt = f'''
-You are a crack analysis expert. The following is the quantified crack analysis result:
-{df.to_string(index=False)}
+You are a crack analysis expert. The following is a statistical digest of the quantified crack analysis results:
+{digest}
 
 Please summarize in natural language:
 1. How many images were analyzed?
@@ -83,19 +102,15 @@ Please summarize in natural language:
 3. How many images are non-compliant (due to max width, area, or length)?
 4. Provide a general assessment and suggestions.
 '''
-        completion = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
-        )
-        return completion.choices[0].message.content.strip()
+        completion = chat([{"role": "user", "content": prompt}], temperature=0)
+        return completion.strip()
 
     except Exception as e:
         return f"❌ GPT summarization failed: {type(e).__name__}: {e}"
 
 summarize_results_spec = {
     "name": "summarize_results",
-    "description": "Read output/result_metrics.csv and generate a crack analysis summary including max width, compliance issues, and suggestions",
+    "description": "Read the latest analysis results and generate a crack analysis summary including max width, compliance issues, and suggestions",
     "parameters": {
         "type": "object",
         "properties": {},
@@ -108,13 +123,32 @@ def extract_image_paths(text: str) -> dict:
     match = re.search(r"(input_images[\\/][\w\-.]+)", text)
     if not match:
         return {}
-    base = os.path.splitext(os.path.basename(match.group(1)))[0]
+    fname = os.path.basename(match.group(1).rstrip("."))  # 句末的句点不属于文件名
+    base = os.path.splitext(fname)[0]
+    # 掩膜保存在 mask_store 中（以原文件名为键），界面需要 PNG 时才导出，已导出且未过期时直接复用
+    mask_path = mask_store.export_png(fname) or f"output/result_images/{base}_mask.png"
     return {
-        "original": f"input_images/{base}.jpg",
-        "mask": f"output/result_images/{base}_mask.png",
+        "original": f"input_images/{fname}",
+        "mask": mask_path,
         "width": f"output/result_images/{base}_width.png",
     }
 
+def extract_image_arrays(result) -> dict:
+    """
+    Same images as extract_image_paths, as in-memory RGB / grayscale arrays for the UI.
+    Taken from the arrays the tool returned with its result (ToolResult.images), so they always
+    match the reply, with nothing read back from disk; {} for results without images.
+    """
+    images = getattr(result, "images", None)
+    if not images:
+        return {}
+    original, mask, width = images.get("original"), images.get("mask"), images.get("width")
+    return {
+        "original": cv2.cvtColor(original, cv2.COLOR_BGR2RGB) if original is not None else None,
+        "mask": None if mask is None else np.asarray(mask),
+        "width": cv2.cvtColor(width, cv2.COLOR_BGR2RGB) if width is not None and width.ndim == 3 else width,
+    }
+
 # ========= Register tools for Agent usage =========
 FUNCTION_SCHEMAS = [
     analyze_all_images_spec,